@@ -1,18 +1,89 @@
 import asyncio
-import requests
-import httpx
-import random
+import base64
+import time
+from typing import AsyncIterator
 
-from app.utils import save_json, encode_image
+import orjson
+
+from app.capture import capture
+from app.client import LLMClient
+from app.metrics import record_llm
+from app.scheduler import ModelScheduler
 from config import config
 
-session = requests.Session()
+class ImagePart:
+    """Image inside a payload, written into the body as base64 by build_body (after `prefix`, e.g. a data url)."""
+    __slots__ = ('data', 'prefix')
+
+    def __init__(self, data: bytes, prefix: str = ''):
+        self.data = data
+        self.prefix = prefix
+
+    # what captures show instead of the image
+    def __str__(self):
+        return f"{self.prefix}<image {len(self.data)} bytes>"
+
+
+def build_body(payload) -> bytes:
+    """Serialize payload once with orjson, writing each ImagePart's base64 directly into the body.
+
+    Nothing is searched for in the serialized text, so user strings in the payload can't be mistaken for an image.
+    """
+    chunks = []
+    _serialize(payload, chunks)
+    return b"".join(chunks)
+
+
+def _serialize(value, chunks: list):
+    if isinstance(value, ImagePart):
+        chunks += (orjson.dumps(value.prefix)[:-1], base64.b64encode(value.data), b'"')
+    elif isinstance(value, dict):
+        chunks.append(b'{')
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                chunks.append(b',')
+            chunks += (orjson.dumps(key), b':')
+            _serialize(item, chunks)
+        chunks.append(b'}')
+    elif isinstance(value, list):
+        chunks.append(b'[')
+        for i, item in enumerate(value):
+            if i:
+                chunks.append(b',')
+            _serialize(item, chunks)
+        chunks.append(b']')
+    else:
+        chunks.append(orjson.dumps(value))
+
+
+class ProviderError(RuntimeError):
+    """Non-200 answer to a streamed request, keeps the status and headers for the scheduler and metrics"""
+
+    def __init__(self, status_code: int, headers: dict, text: str):
+        super().__init__(f"status {status_code}: {text[:200]}")
+        self.status_code = status_code
+        self.headers = headers
+
+
+# server-sent events from a streamed provider response, one parsed json per event
+async def iter_sse(url: str, headers: dict, body: bytes) -> AsyncIterator[dict]:
+    async with LLMClient.stream(url, headers=headers, content=body) as r:
+        if r.status_code != 200:
+            await r.aread()
+            raise ProviderError(r.status_code, r.headers, r.text)
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            yield orjson.loads(data)
 
 
 class LlamaVisionLLM:
     """Class for handling Groq LLM requests."""
 
-    BASE_URL = "https://api.groq.com/openai/v1/chat/completions"
+    BASE_URL = f"{config.groq_base_url}/chat/completions"
     API_KEY = config.GROQ_API_KEY
     model = "llama-3.2-90b-vision-preview"
 
@@ -21,31 +92,73 @@ class LlamaVisionLLM:
             "Authorization": f"Bearer {self.API_KEY}",
             "Content-Type": "application/json",
         }
-        payload = {"messages": conversation, "model": self.model}
-        save_json(payload, "./llm_last_request.json")
+        messages = []
+        for msg in conversation:
+            if isinstance(msg["content"], list):
+                content = []
+                for item in msg["content"]:
+                    if item["type"] == "image":
+                        url = ImagePart(item["data"], prefix=f"data:{item['mime_type']};base64,")
+                        content.append({"type": "image_url", "image_url": {"url": url}})
+                    else:
+                        content.append(item)
+                msg = {**msg, "content": content}
+            messages.append(msg)
+
+        payload = {"messages": messages, "model": self.model}
         return self.BASE_URL, headers, payload
 
+    @staticmethod
+    def usage(response: dict) -> tuple[int, int] | None:
+        """(prompt tokens, completion tokens) reported by the api"""
+        usage = response.get("usage") or (response.get("x_groq") or {}).get("usage")
+        return (usage.get("prompt_tokens"), usage.get("completion_tokens")) if usage else None
+
     async def send_chat_request(self, conversation: list) -> dict:
         url, headers, payload = self._prepare_request(conversation)
-        async with httpx.AsyncClient(timeout=60) as client:
-            try:
-                r = await client.post(url, headers=headers, json=payload)
-                response_dict = r.json()
-                response_dict['status_code'] = r.status_code
-            except Exception as e:
-                return {"error": str(e), "status_code": r.status_code if 'r' in locals() else 500}
-        save_json(response_dict, "./llm_last_response.json")
+        body = build_body(payload)
+        start_time = time.monotonic()
+        try:
+            r = await LLMClient.post(url, headers=headers, content=body)
+            response_dict = orjson.loads(r.content)
+            response_dict['status_code'] = r.status_code
+        except Exception as e:
+            response_dict = {"error": str(e), "status_code": r.status_code if 'r' in locals() else 500}
+        latency = time.monotonic() - start_time
+        record_llm('groq', self.model, latency, response_dict['status_code'], self.usage(response_dict))
+        capture.record('groq', self.model, payload, response_dict, latency)
         return response_dict
 
     async def parse_answer(self, conversation: list) -> str:
         response = await self.send_chat_request(conversation)
         return response.get("choices", [{}])[0].get("message", {}).get("content", "Error: no response")
 
+    async def stream_answer(self, conversation: list) -> AsyncIterator[str]:
+        """Yields the answer text piece by piece as the model generates it."""
+        url, headers, payload = self._prepare_request(conversation)
+        payload["stream"] = True
+        start_time = time.monotonic()
+        first_chunk, usage, status_code = None, None, 500
+        try:
+            async for chunk in iter_sse(url, headers, build_body(payload)):
+                first_chunk = first_chunk or time.monotonic() - start_time
+                usage = self.usage(chunk) or usage  # comes with the last chunk
+                text = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                if text:
+                    yield text
+        except ProviderError as e:
+            status_code = e.status_code
+            raise
+        finally:
+            record_llm('groq', self.model, first_chunk or time.monotonic() - start_time,
+                       200 if first_chunk else status_code, usage)
+
 
 class GeminiLLM:
     """Class for handling Google Gemini API requests."""
 
-    BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+    BASE_URL = config.gemini_base_url + "/models/{model}:generateContent"
+    STREAM_URL = config.gemini_base_url + "/models/{model}:streamGenerateContent"
     API_KEY = config.GEMINI_API_KEY
     models = [
         'gemini-1.5-flash-8b',
@@ -53,8 +166,10 @@ class GeminiLLM:
         'gemini-2.0-flash-lite',
         'gemini-2.0-flash',
     ]
+    scheduler = ModelScheduler(models, rpm=config.gemini_model_rpm, breaker_errors=config.llm_breaker_errors,
+                               cooldown=config.llm_breaker_cooldown_sec)
 
-    def _prepare_request(self, conversation: list):
+    def _prepare_request(self, conversation: list, generation_config: dict = None):
         """Formats request for Gemini API."""
         messages = []
         for msg in conversation:
@@ -65,51 +180,94 @@ class GeminiLLM:
                 for item in msg["content"]:
                     if "text" in item:
                         parts.append({"text": item["text"]})
-                    elif "image_url" in item:
+                    elif item["type"] == "image":
                         parts.append({
                             "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": item["image_url"]["url"].split(",")[-1]
+                                "mime_type": item["mime_type"],
+                                "data": ImagePart(item["data"])
                             }
                         })
             messages.append({"parts": parts})
 
         payload = {"contents": messages}
+        if generation_config:
+            payload["generationConfig"] = generation_config
         headers = {"Content-Type": "application/json"}
-        save_json(payload, "./llm_last_request.json")
         return f"{self.BASE_URL}?key={self.API_KEY}", headers, payload
 
-    async def send_chat_request(self, conversation: list) -> dict:
-        url, headers, payload = self._prepare_request(conversation)
+    @staticmethod
+    def usage(response: dict) -> tuple[int, int] | None:
+        """(prompt tokens, completion tokens) reported by the api"""
+        usage = response.get("usageMetadata")
+        return (usage.get("promptTokenCount"), usage.get("candidatesTokenCount")) if usage else None
 
-        # pick random model for even distribution of api usage
-        model = random.choice(self.models)
-        print(f'{model = }')
+    async def send_chat_request(self, conversation: list, generation_config: dict = None) -> dict:
+        url, headers, payload = self._prepare_request(conversation, generation_config)
+        body = build_body(payload)
+
+        # pick the healthiest model, skipping throttled and failing ones
+        model = self.scheduler.pick()
         url = url.format(model=model)
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            try:
-                r = await client.post(url, headers=headers, json=payload)
-                response_dict = r.json()
-                response_dict['status_code'] = r.status_code
-            except Exception as e:
-                return {"error": str(e), "status_code": r.status_code if 'r' in locals() else 500}
-        save_json(response_dict, "./llm_last_response.json")
+        start_time = time.monotonic()
+        try:
+            r = await LLMClient.post(url, headers=headers, content=body)
+            self.scheduler.record(model, time.monotonic() - start_time, r.status_code, r.headers)
+            response_dict = orjson.loads(r.content)
+            response_dict['status_code'] = r.status_code
+        except Exception as e:
+            if 'r' not in locals():
+                self.scheduler.record(model, time.monotonic() - start_time, 500)
+            response_dict = {"error": str(e), "status_code": r.status_code if 'r' in locals() else 500}
+        latency = time.monotonic() - start_time
+        record_llm('gemini', model, latency, response_dict['status_code'], self.usage(response_dict))
+        capture.record('gemini', model, payload, response_dict, latency)
         return response_dict
 
-    async def parse_answer(self, conversation: list) -> str:
-        response = await self.send_chat_request(conversation)
+    async def parse_answer(self, conversation: list, generation_config: dict = None) -> str:
+        response = await self.send_chat_request(conversation, generation_config)
         return response.get('candidates', [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "Error: no response")
 
+    async def stream_answer(self, conversation: list) -> AsyncIterator[str]:
+        """Yields the answer text piece by piece as the model generates it."""
+        _, headers, payload = self._prepare_request(conversation)
+        model = self.scheduler.pick()
+        url = f"{self.STREAM_URL.format(model=model)}?alt=sse&key={self.API_KEY}"
+
+        start_time = time.monotonic()
+        first_chunk, usage, status_code = None, None, 500
+        try:
+            async for chunk in iter_sse(url, headers, build_body(payload)):
+                if not first_chunk:
+                    # latency to the first chunk is what matters when streaming
+                    first_chunk = time.monotonic() - start_time
+                    self.scheduler.record(model, first_chunk, 200)
+                usage = self.usage(chunk) or usage  # running total, the last one is final
+                for part in (chunk.get('candidates') or [{}])[0].get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+        except ProviderError as e:
+            # a 429 puts the model in cooldown like in send_chat_request
+            status_code = e.status_code
+            self.scheduler.record(model, time.monotonic() - start_time, status_code, e.headers)
+            raise
+        except Exception:
+            if not first_chunk:
+                self.scheduler.record(model, time.monotonic() - start_time, 500)
+            raise
+        finally:
+            record_llm('gemini', model, first_chunk or time.monotonic() - start_time,
+                       200 if first_chunk else status_code, usage)
+
 
 # подготовить сообщение от юзера для LLM
-def user_message(prompt: str, encoded_image=None) -> dict:
+# image is kept as raw bytes, providers base64 it straight into the request body
+def user_message(prompt: str, image: bytes = None, mime_type: str = "image/png") -> dict:
     # если сообщение с изображением
-    if encoded_image:
+    if image:
         content = [
             {"type": "text", "text": prompt},
-            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}
-             }
+            {"type": "image", "mime_type": mime_type, "data": image}
         ]
         msg_dict = {"role": "user", "content": content, }
 
@@ -136,8 +294,9 @@ if __name__ == '__main__':
         file = "doodle_car.png"
         prompt = open('../prompt.txt', 'r', encoding='utf-8').read().format(item_name='car')
         prompt = 'describe picture'
-        encoded_img = encode_image(file)
-        user_msg = user_message(prompt, encoded_image=encoded_img)
+        with open(file, 'rb') as f:
+            image = f.read()
+        user_msg = user_message(prompt, image=image)
         conv = [user_msg]
 
         # Groq LLM
@@ -149,5 +308,7 @@ if __name__ == '__main__':
         gemini_llm = GeminiLLM()
         gemini_response = await gemini_llm.parse_answer(conv)
         print("Gemini Response:", gemini_response)
+        print("Client stats:", LLMClient.stats)
+        await LLMClient.close()
 
     asyncio.run(example())
@@ -0,0 +1,156 @@
+"""Fingerprinted, precompressed static assets.
+
+Build step, run before deploying (or after changing static/js or static/css):
+
+    python -m app.assets
+
+writes static/dist/<dir>/<name>.<hash>.<ext> plus .gz copies and static/dist/manifest.json,
+and .br copies too when the optional brotli package is installed (pip install brotli).
+Templates link assets through asset_url(), which points at the fingerprinted copy when there is one,
+so those can be cached by browsers forever.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+from mimetypes import guess_type
+
+import orjson
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from logger import logger
+
+try:
+    import brotli
+except ImportError:  # optional, without it only gzip copies are built
+    brotli = None
+
+STATIC_DIR = 'static'
+DIST_DIR = 'dist'                  # inside STATIC_DIR
+SOURCE_DIRS = ('js', 'css')
+MANIFEST = 'manifest.json'
+URL_PREFIX = '/static/'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'            # may be cached, but always checked with ETag / Last-Modified
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # preferred first
+
+
+def build(static_dir: str = STATIC_DIR) -> dict:
+    """Write fingerprinted and compressed copies of static/js and static/css, returns the manifest"""
+    dist = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    files = {}
+    for source_dir in SOURCE_DIRS:
+        for root, _, names in os.walk(os.path.join(static_dir, source_dir)):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, static_dir).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                stem, ext = os.path.splitext(rel)
+                target = f"{DIST_DIR}/{stem}.{hashlib.blake2b(data, digest_size=4).hexdigest()}{ext}"
+                target_path = os.path.join(static_dir, target)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                with open(target_path, 'wb') as f:
+                    f.write(data)
+                with open(target_path + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli:
+                    with open(target_path + '.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+                files[rel] = target
+
+    manifest = {"files": files, "encodings": [e for e, _ in ENCODINGS if e != 'br' or brotli]}
+    with open(os.path.join(dist, MANIFEST), 'wb') as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+    return manifest
+
+
+def load_manifest(static_dir: str = STATIC_DIR) -> dict:
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST), 'rb') as f:
+            return orjson.loads(f.read())
+    except OSError:
+        logger.warning(f"no {DIST_DIR}/{MANIFEST}, serving unversioned assets (run python -m app.assets)")
+        return {"files": {}, "encodings": []}
+
+
+manifest = load_manifest()
+_fingerprinted = set(manifest["files"].values())
+
+
+# jinja global: {{ asset_url('js/draw.js') }}
+def asset_url(path: str) -> str:
+    return URL_PREFIX + manifest["files"].get(path, path)
+
+
+def accepted_encoding(accept_encoding: str, available) -> str | None:
+    """First of `available` the client accepts (q > 0), None for identity.
+
+    "*" stands for encodings not named otherwise, an explicit q=0 refusal always wins over it.
+    """
+    accepted, rejected = set(), set()
+    for token in accept_encoding.split(','):
+        name, _, params = token.strip().partition(';')
+        name, q = name.strip().lower(), params.strip()
+        try:
+            refused = q.startswith('q=') and float(q[2:] or 0) <= 0
+        except ValueError:
+            refused = True
+        (rejected if refused else accepted).add(name)
+    for encoding in available:
+        if encoding in rejected:
+            continue
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check: "*" or any listed tag equal to etag, weak (W/) tags compared by their value"""
+    if not if_none_match:
+        return False
+    etag = etag.removeprefix('W/')
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that serves precompressed copies of fingerprinted assets and marks them immutable.
+
+    Everything else is served as before, with a revalidation Cache-Control.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        rel = self.get_path(scope).replace(os.sep, '/')
+        if rel not in _fingerprinted:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                    headers={"Cache-Control": REVALIDATE})
+        else:
+            headers = {"Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+            encoding = accepted_encoding(request_headers.get('accept-encoding', ''), manifest["encodings"])
+            if encoding:
+                try:
+                    encoded_path = str(full_path) + dict(ENCODINGS)[encoding]
+                    stat_result, full_path = os.stat(encoded_path), encoded_path
+                    headers["Content-Encoding"] = encoding
+                except OSError:
+                    # listed in the manifest but not on disk: serve the identity file
+                    logger.warning(f"missing {encoded_path}, rebuild assets (python -m app.assets)")
+            # media type still from the original name, not .gz / .br
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers,
+                                    media_type=guess_type(rel)[0])
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+if __name__ == '__main__':
+    result = build()
+    print(f"{len(result['files'])} assets, encodings: {', '.join(result['encodings'])}")
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import orjson
+
+from app.ai import GeminiLLM, has_user_passed_task
+from app.metrics import llm_unparsed
+from app.retry import LLMRetry, LLMVerdict
+from logger import logger
+
+BATCH_INTRO = "You will get {n} drawings, all made for the task below. Grade every drawing separately."
+BATCH_OUTRO = ("Answer with a JSON array of exactly {n} strings, in the same order as the drawings. "
+               "Each string is the answer for that drawing, following the task and starting with ✅ or ❌.")
+
+
+def prompt_text(msg: dict) -> str:
+    return ''.join(item["text"] for item in msg["content"] if item["type"] == "text")
+
+
+class MicroBatcher:
+    """Collects drawings for a short window and grades them in one multi-image Gemini call.
+
+    Only drawings with the very same prompt share a batch: the prompt holds the client's item_name,
+    so text from one submission never ends up in a call that grades another user's drawing.
+    """
+
+    def __init__(self, llm: GeminiLLM, fallback: LLMRetry, window: float, max_size: int):
+        self.llm = llm
+        self.fallback = fallback        # per-image path when a batch answer is unusable
+        self.window = window            # сек
+        self.max_size = max_size
+        # prompt -> [(message, future, enqueued at)], one timer per prompt
+        self._pending: dict[str, list[tuple[dict, asyncio.Future, float]]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.stats = {"batches": 0, "images": 0, "fallbacks": 0}
+
+    async def ask(self, conversation: list) -> LLMVerdict:
+        """Same contract as LLMRetry.ask for a single-message conversation."""
+        msg = conversation[-1]
+        key = prompt_text(msg)
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((msg, future, time.monotonic()))
+        if len(pending) >= self.max_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            self._spawn(self._run(batch))
+
+    # what is left of the per-drawing deadline for something enqueued at `enqueued`
+    def _remaining(self, enqueued: float) -> float:
+        return self.fallback.deadline - (time.monotonic() - enqueued)
+
+    # keep a reference so running tasks are not garbage collected
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # one user message: intro, the shared task once, an image per drawing, then the answer format
+    @staticmethod
+    def _batch_conversation(messages: list[dict]) -> list:
+        content = [{"type": "text", "text": BATCH_INTRO.format(n=len(messages))},
+                   {"type": "text", "text": f"Task: {prompt_text(messages[0])}"}]
+        for i, msg in enumerate(messages, 1):
+            content.append({"type": "text", "text": f"Drawing {i}."})
+            content += [item for item in msg["content"] if item["type"] != "text"]
+        content.append({"type": "text", "text": BATCH_OUTRO.format(n=len(messages))})
+        return [{"role": "user", "content": content}]
+
+    async def _run(self, batch: list[tuple[dict, asyncio.Future, float]]):
+        self.stats["batches"] += 1
+        self.stats["images"] += len(batch)
+        answers = []
+        if len(batch) > 1:
+            try:
+                # the oldest drawing in the batch has the least time left
+                text = await asyncio.wait_for(
+                    self.llm.parse_answer(self._batch_conversation([msg for msg, _, _ in batch]),
+                                          generation_config={"responseMimeType": "application/json"}),
+                    timeout=max(self._remaining(min(enqueued for _, _, enqueued in batch)), 0))
+                answers = orjson.loads(text)
+                if not isinstance(answers, list) or len(answers) != len(batch):
+                    raise ValueError(f"expected {len(batch)} answers")
+            except Exception as e:
+                logger.warning(f"batch of {len(batch)} unusable, grading one by one: {type(e).__name__}('{e}')")
+                answers = []
+
+        for i, (msg, future, enqueued) in enumerate(batch):
+            answer = answers[i] if i < len(answers) and isinstance(answers[i], str) else ''
+            passed = has_user_passed_task(answer) if answer else None
+            if passed is not None:
+                if not future.done():
+                    future.set_result(LLMVerdict(message=answer, passed=passed, attempts=1, provider='batch'))
+                continue
+            # malformed or missing answer: this drawing goes the regular way
+            if len(batch) > 1:
+                self.stats["fallbacks"] += 1
+                llm_unparsed.labels('batch').inc()
+            self._spawn(self._single(msg, future, enqueued))
+
+    # the regular path, within what is left of the drawing's deadline after the window and the batch call
+    async def _single(self, msg: dict, future: asyncio.Future, enqueued: float):
+        try:
+            verdict = await self.fallback.ask([msg], deadline=self._remaining(enqueued))
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(verdict)
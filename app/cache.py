@@ -0,0 +1,143 @@
+import hashlib
+import io
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image
+
+from app import dao
+from app.metrics import registry
+from config import config
+from logger import logger
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def items(self) -> list[tuple]:
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def __len__(self):
+        return len(self._data)
+
+
+# difference hash: survives re-encoding and tiny pixel changes of the same drawing
+def perceptual_hash(image: bytes, size: int = 16) -> str:
+    img = Image.open(io.BytesIO(image)).convert('L').resize((size + 1, size), Image.Resampling.BILINEAR)
+    px = img.tobytes()
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = bits << 1 | (px[offset + col] > px[offset + col + 1])
+    return f'{bits:0{size * size // 4}x}'
+
+
+class VerdictCache:
+    """LLM verdicts by drawing fingerprint + task: memory first, then optionally the db."""
+
+    def __init__(self, maxsize: int, ttl: int, use_db: bool = False, perceptual: bool = False):
+        self.memory = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.use_db = use_db
+        self.perceptual = perceptual
+        self.stats = {"hits": 0, "db_hits": 0, "misses": 0}
+
+    def key(self, image: bytes, item_name: str, language: str) -> str:
+        fingerprint = None
+        if self.perceptual:
+            try:
+                fingerprint = perceptual_hash(image)
+            except OSError:  # not a decodable image
+                pass
+        fingerprint = fingerprint or hashlib.sha256(image).hexdigest()
+        return f"{fingerprint}:{item_name.strip().lower()}:{language}"
+
+    async def get(self, key: str) -> dict | None:
+        verdict = self.memory.get(key)
+        if verdict:
+            self.stats["hits"] += 1
+            return verdict
+
+        if self.use_db:
+            try:
+                row = await dao.VerdictDAO.find_one_or_none(cache_key=key)
+            except Exception as e:
+                row = None
+                logger.warning(f"verdict cache db read failed: {e}")
+            if row and row['created'] > datetime.now(timezone.utc) - timedelta(seconds=self.ttl):
+                verdict = {"message": row['message'], "passed": row['passed']}
+                self.memory.set(key, verdict)
+                self.stats["db_hits"] += 1
+                return verdict
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, message: str, passed: bool):
+        self.memory.set(key, {"message": message, "passed": passed})
+        if self.use_db:
+            try:
+                await dao.VerdictDAO.upsert(cache_key=key, message=message, passed=passed,
+                                            created=datetime.now(timezone.utc))
+            except Exception as e:
+                logger.warning(f"verdict cache db write failed: {e}")
+
+
+verdict_cache = VerdictCache(maxsize=config.verdict_cache_size, ttl=config.verdict_cache_ttl_sec,
+                             use_db=config.verdict_cache_db, perceptual=config.verdict_cache_phash)
+
+
+# authenticated users by username, and usernames by already verified token
+user_cache = TTLCache(maxsize=config.user_cache_size, ttl=config.user_cache_ttl_sec)
+token_cache = TTLCache(maxsize=config.user_cache_size, ttl=config.user_cache_ttl_sec)
+
+
+registry.callback('cache_requests', 'Cache lookups by result', ('cache', 'result'), lambda: {
+    ('verdict', 'hit'): verdict_cache.stats["hits"],
+    ('verdict', 'db_hit'): verdict_cache.stats["db_hits"],
+    ('verdict', 'miss'): verdict_cache.stats["misses"],
+    ('user', 'hit'): user_cache.hits,
+    ('user', 'miss'): user_cache.misses,
+    ('token', 'hit'): token_cache.hits,
+    ('token', 'miss'): token_cache.misses,
+}, type='counter')
+
+
+def forget_user(row: dict, pk_column: str):
+    """Drop a changed user from the cache, by username or else by primary key."""
+    if user_cache.pop(row.get('username')) is not None:
+        return
+    # renamed user, or a bulk update without the username: find the entry by id
+    for username, user in user_cache.items():
+        if user.get(pk_column) == row.get(pk_column):
+            user_cache.pop(username)
@@ -0,0 +1,64 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+import orjson
+
+from config import config
+
+
+class ExchangeCapture:
+    """Keeps a sample of LLM request/response pairs in memory, optionally writing them to rotating files."""
+
+    def __init__(self, rate: float, size: int, directory: str = None):
+        self.rate = rate
+        self.exchanges = deque(maxlen=size)
+        self.directory = directory
+        self._queue = queue.SimpleQueue()
+        self._thread: threading.Thread = None
+
+    def record(self, provider: str, model: str, request: dict, response: dict, latency: float):
+        if not self.rate or random.random() >= self.rate:
+            return
+        # images (app.ai.ImagePart) are swapped for their str() here: the image bytes are never captured
+        request = orjson.loads(orjson.dumps(request, default=str))
+        exchange = {"time": time.time(), "provider": provider, "model": model,
+                    "latency_ms": round(latency * 1000, 1), "status_code": response.get("status_code"),
+                    "request": request, "response": response}
+        self.exchanges.append(exchange)
+        if self.directory:
+            self._start()
+            self._queue.put(exchange)
+
+    def last(self, n: int) -> list[dict]:
+        return list(self.exchanges)[-n:] if n > 0 else []
+
+    def _start(self):
+        if not self._thread:
+            self._thread = threading.Thread(target=self._write, name='llm-capture', daemon=True)
+            self._thread.start()
+
+    # serialize and write on the background thread, never on the event loop
+    def _write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        handler = RotatingFileHandler(os.path.join(self.directory, 'llm_exchanges.jsonl'),
+                                      maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8')
+        while (exchange := self._queue.get()) is not None:
+            line = orjson.dumps(exchange, option=orjson.OPT_NON_STR_KEYS).decode()
+            handler.handle(logging.makeLogRecord({"msg": line}))
+        handler.close()
+
+    def close(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+capture = ExchangeCapture(rate=config.llm_capture_rate, size=config.llm_capture_size,
+                          directory=config.llm_capture_dir)
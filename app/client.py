@@ -0,0 +1,82 @@
+import httpx
+
+from app.metrics import registry
+from config import config
+
+
+class LLMClient:
+    """Shared pooled http client for all LLM providers."""
+
+    # client to be initialized at application startup
+    _client: httpx.AsyncClient = None
+
+    # connection reuse stats
+    stats = {
+        "requests": 0,          # requests sent
+        "connections": 0,       # new tcp connections opened
+        "tls_handshakes": 0,    # new tls handshakes
+        "errors": 0,            # transport errors
+    }
+
+    @classmethod
+    def _create_client(cls) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=config.llm_max_connections,
+            max_keepalive_connections=config.llm_max_keepalive,
+            keepalive_expiry=config.llm_keepalive_expiry,
+        )
+        timeout = httpx.Timeout(config.llm_timeout, connect=config.llm_connect_timeout)
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=config.llm_http2)
+
+    @classmethod
+    async def start(cls):
+        if not cls._client:
+            cls._client = cls._create_client()
+
+    @classmethod
+    async def close(cls):
+        if cls._client:
+            await cls._client.aclose()
+            cls._client = None
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        # lazy init for scripts that don't run the app startup hook
+        if not cls._client:
+            cls._client = cls._create_client()
+        return cls._client
+
+    # count connection events reported by httpcore
+    @classmethod
+    async def _trace(cls, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            cls.stats["connections"] += 1
+        elif event_name == "connection.start_tls.complete":
+            cls.stats["tls_handshakes"] += 1
+
+    @classmethod
+    async def post(cls, url: str, **kwargs) -> httpx.Response:
+        cls.stats["requests"] += 1
+        try:
+            return await cls.client().post(url, extensions={"trace": cls._trace}, **kwargs)
+        except httpx.TransportError:
+            cls.stats["errors"] += 1
+            raise
+
+    # streamed response: use as `async with LLMClient.stream(url, ...) as r:`
+    @classmethod
+    def stream(cls, url: str, **kwargs):
+        cls.stats["requests"] += 1
+        return cls.client().stream("POST", url, extensions={"trace": cls._trace}, **kwargs)
+
+    @classmethod
+    def reuse_ratio(cls) -> float:
+        """Share of requests served over an already open connection."""
+        requests = cls.stats["requests"]
+        if not requests:
+            return 0.0
+        return max(requests - cls.stats["connections"], 0) / requests
+
+
+registry.callback('llm_http_events', 'LLM http client: requests, new connections, tls handshakes, errors',
+                  ('event',), lambda: {(k,): v for k, v in LLMClient.stats.items()}, type='counter')
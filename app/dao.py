@@ -1,38 +1,169 @@
-from typing import Optional, Dict, Any, List, Union
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Union, AsyncIterator
 import asyncio
+import time
 
 import asyncpg
 
+from app.metrics import registry, db_acquire_wait
 from config import config
+from logger import logger
 
 
 class AsyncBaseDAO:
     db_url = f"postgresql://{config.user}:{config.password}@{config.host}:{config.port}/{config.dbname}"
+    # optional read replica, same credentials
+    replica_url = (f"postgresql://{config.user}:{config.password}@{config.db_replica_host}:{config.db_replica_port}"
+                   f"/{config.dbname}") if config.db_replica_host else None
 
     table_name: str = None
     pk_column: str = "id"  # primary key column name
+    ddl: str | tuple = None  # CREATE ... IF NOT EXISTS statement(s), executed at startup
 
-    # connection pool to be initialized at application startup
-    _pool: asyncpg.pool.Pool = None
-    _daos: set['AsyncPGBaseDAO'] = set()
+    # connection pools shared by all DAOs, initialized at application startup
+    _pool: asyncpg.pool.Pool = None         # primary, all writes
+    _read_pool: asyncpg.pool.Pool = None    # replica for reads, if configured
+    _daos: set['AsyncBaseDAO'] = set()
+
+    # time spent waiting for a free connection
+    acquire_stats = {"acquires": 0, "wait_total": 0.0, "wait_max": 0.0, "timeouts": 0}
+
+    _sql_cache: dict = {}
 
     # all DAOs automatically register themselves
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
         cls._daos.add(cls)
+        cls._sql_cache = {}
+
+    @staticmethod
+    async def _create_pool(dsn: str) -> asyncpg.pool.Pool:
+        return await asyncpg.create_pool(
+            dsn,
+            min_size=config.db_pool_min,
+            max_size=config.db_pool_max,
+            statement_cache_size=config.db_statement_cache_size,
+            max_queries=config.db_max_queries,
+            max_inactive_connection_lifetime=config.db_max_inactive_lifetime,
+        )
 
+    # pools are set on the base class only, so every DAO sees the same ones
     @classmethod
     async def initialize_pools(cls):
+        if not AsyncBaseDAO._pool:
+            AsyncBaseDAO._pool = await cls._create_pool(cls.db_url)
+        if cls.replica_url and not AsyncBaseDAO._read_pool:
+            AsyncBaseDAO._read_pool = await cls._create_pool(cls.replica_url)
+
+        # create service tables owned by the app, and constraints the app relies on
         for dao in cls._daos:
-            if not dao._pool:
-                cls._pool = await asyncpg.create_pool(cls.db_url)
+            for statement in ((dao.ddl,) if isinstance(dao.ddl, str) else dao.ddl or ()):
+                try:
+                    await AsyncBaseDAO._pool.execute(statement)
+                except asyncpg.PostgresError as e:
+                    logger.warning(f"{dao.__name__}: could not apply {statement!r}: {e}")
 
     @classmethod
     async def close_pools(cls):
-        for dao in cls._daos:
-            if dao._pool:
-                await dao._pool.close()
-                dao._pool = None
+        for name in ('_pool', '_read_pool'):
+            pool = getattr(AsyncBaseDAO, name)
+            if pool:
+                await pool.close()
+                setattr(AsyncBaseDAO, name, None)
+
+    @classmethod
+    @asynccontextmanager
+    async def _acquire(cls, read: bool = False):
+        """Connection from the primary, or from the replica for reads when there is one"""
+        pool = (read and AsyncBaseDAO._read_pool) or AsyncBaseDAO._pool
+        stats = AsyncBaseDAO.acquire_stats
+        start_time = time.perf_counter()
+        try:
+            conn = await pool.acquire(timeout=config.db_acquire_timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            raise
+        wait = time.perf_counter() - start_time
+        stats["acquires"] += 1
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        db_acquire_wait.observe(wait)
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        """Size, in-use and idle connections per pool, plus acquire wait times"""
+        result = {}
+        for name, pool in (('primary', AsyncBaseDAO._pool), ('replica', AsyncBaseDAO._read_pool)):
+            if pool:
+                size, idle = pool.get_size(), pool.get_idle_size()
+                result[name] = {"size": size, "idle": idle, "in_use": size - idle,
+                                "min": pool.get_min_size(), "max": pool.get_max_size()}
+        stats = AsyncBaseDAO.acquire_stats
+        result["acquire"] = {**stats, "wait_avg": stats["wait_total"] / stats["acquires"] if stats["acquires"] else 0}
+        return result
+
+    # SQL text is built once per (operation, columns) and reused; identical text also lets
+    # asyncpg's per-connection statement cache keep it prepared on the server
+    @classmethod
+    def _sql(cls, op: str, columns: tuple = ()) -> str:
+        key = (op, columns)
+        sql = cls._sql_cache.get(key)
+        if sql is None:
+            sql = cls._sql_cache[key] = cls._build_sql(op, columns)
+        return sql
+
+    @classmethod
+    def _build_sql(cls, op: str, columns: tuple) -> str:
+        where = " AND ".join([f"{k} = ${i + 1}" for i, k in enumerate(columns)])
+        if op == "find_one":
+            return f"SELECT * FROM {cls.table_name} WHERE {where} LIMIT 1"
+        if op == "find_all":
+            return f"SELECT * FROM {cls.table_name}" + (f" WHERE {where}" if columns else "")
+        if op == "find_page":
+            filters, after = columns  # (filter columns, whether rows start after a given key)
+            conditions = [f"{k} = ${i + 1}" for i, k in enumerate(filters)]
+            if after:
+                conditions.append(f"{cls.pk_column} > ${len(conditions) + 1}")
+            return (f"SELECT * FROM {cls.table_name}"
+                    + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+                    + f" ORDER BY {cls.pk_column} LIMIT ${len(conditions) + 1}")
+        if op == "add":
+            placeholders = ", ".join([f"${i + 1}" for i in range(len(columns))])
+            return (f"INSERT INTO {cls.table_name} ({', '.join(columns)}) "
+                    f"VALUES ({placeholders}) "
+                    f"RETURNING {', '.join(columns)}")
+        if op in ("insert_if_absent", "upsert"):
+            values, target = columns  # (value columns, conflict target)
+            placeholders = ", ".join([f"${i + 1}" for i in range(len(values))])
+            conflict = f"ON CONFLICT ({', '.join(target)})" if target else "ON CONFLICT"
+            if op == "insert_if_absent":
+                action = "DO NOTHING"
+            else:
+                action = "DO UPDATE SET " + ", ".join([f"{k} = EXCLUDED.{k}" for k in values if k not in target])
+            return (f"INSERT INTO {cls.table_name} ({', '.join(values)}) "
+                    f"VALUES ({placeholders}) "
+                    f"{conflict} {action} "
+                    f"RETURNING *")
+        if op == "update":
+            set_clause = ", ".join([f"{k} = ${i + 1}" for i, k in enumerate(columns)])
+            return (f"UPDATE {cls.table_name} "
+                    f"SET {set_clause} "
+                    f"WHERE {cls.pk_column} = ${len(columns) + 1} "
+                    f"RETURNING *")
+        if op == "delete":
+            return f"DELETE FROM {cls.table_name} WHERE {cls.pk_column} = $1 RETURNING *"
+        if op == "delete_many":
+            return f"DELETE FROM {cls.table_name} WHERE {cls.pk_column} = ANY($1) RETURNING *"
+        raise ValueError(f"Unknown operation {op}")
+
+    # called with each updated / deleted row, e.g. to drop it from caches
+    @classmethod
+    def _on_change(cls, row: Dict[str, Any]):
+        pass
 
     # CRUD
     @classmethod
@@ -40,47 +171,89 @@ class AsyncBaseDAO:
         if not filter_by:
             raise ValueError("At least one filter condition must be provided")
 
-        async with cls._pool.acquire() as conn:
-            conditions = " AND ".join([f"{k} = ${i + 1}" for i, k in enumerate(filter_by.keys())])
-            values = list(filter_by.values())
-
-            row = await conn.fetchrow(
-                f"SELECT * FROM {cls.table_name} WHERE {conditions}",
-                *values
-            )
+        async with cls._acquire(read=True) as conn:
+            row = await conn.fetchrow(cls._sql("find_one", tuple(filter_by)), *filter_by.values())
             return dict(row) if row else None
 
     @classmethod
     async def find_all(cls, **filter_by) -> List[Dict[str, Any]]:
-        async with cls._pool.acquire() as conn:
-            if filter_by:
-                conditions = " AND ".join([f"{k} = ${i + 1}" for i, k in enumerate(filter_by.keys())])
-                values = list(filter_by.values())
-                query = f"SELECT * FROM {cls.table_name} WHERE {conditions}"
-            else:
-                query = f"SELECT * FROM {cls.table_name}"
-                values = []
-
-            rows = await conn.fetch(query, *values)
+        async with cls._acquire(read=True) as conn:
+            rows = await conn.fetch(cls._sql("find_all", tuple(filter_by)), *filter_by.values())
             return [dict(row) for row in rows]
 
+    @classmethod
+    async def iter_all(cls, chunk_size: int = 500, **filter_by) -> AsyncIterator[Dict[str, Any]]:
+        """Like find_all, but fetches chunk_size rows at a time in primary key order.
+        A connection is held only while a chunk is fetched, so the consumer may stop (break) at any point"""
+        last = None
+        while True:
+            args = (*filter_by.values(), last) if last is not None else tuple(filter_by.values())
+            async with cls._acquire(read=True) as conn:
+                rows = await conn.fetch(cls._sql("find_page", (tuple(filter_by), last is not None)),
+                                        *args, chunk_size)
+            for row in rows:
+                yield dict(row)
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1][cls.pk_column]
+
     @classmethod
     async def add(cls, **values) -> Dict[str, Any]:
         if not values:
             raise ValueError("At least one value must be provided")
 
-        async with cls._pool.acquire() as conn:
-            columns = ", ".join(values.keys())
-            placeholders = ", ".join([f"${i + 1}" for i in range(len(values))])
-            returning_cols = ", ".join(values.keys())
+        async with cls._acquire() as conn:
+            row = await conn.fetchrow(cls._sql("add", tuple(values)), *values.values())
+            return dict(row)
+
+    @classmethod
+    async def add_unique(cls, **values) -> tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Insert in one round-trip, returns (record, None) or (None, name of the violated unique constraint)"""
+        if not values:
+            raise ValueError("At least one value must be provided")
+
+        async with cls._acquire() as conn:
+            try:
+                row = await conn.fetchrow(cls._sql("add", tuple(values)), *values.values())
+            except asyncpg.UniqueViolationError as e:
+                return None, e.constraint_name
+            return dict(row), None
+
+    @classmethod
+    async def insert_if_absent(cls, conflict_columns: tuple = (), **values) -> Optional[Dict[str, Any]]:
+        """Insert unless it conflicts (on conflict_columns, or on any unique constraint if empty).
+        Returns the new record, None if it already existed"""
+        if not values:
+            raise ValueError("At least one value must be provided")
+
+        async with cls._acquire() as conn:
+            row = await conn.fetchrow(cls._sql("insert_if_absent", (tuple(values), tuple(conflict_columns))),
+                                      *values.values())
+            return dict(row) if row else None
+
+    @classmethod
+    async def upsert(cls, conflict_columns: tuple = None, **values) -> Dict[str, Any]:
+        """Insert, or update the other columns of the record conflicting on conflict_columns (pk by default)"""
+        conflict_columns = conflict_columns or (cls.pk_column,)
+        if not set(values) - set(conflict_columns):
+            raise ValueError("At least one value besides the conflict columns must be provided")
 
-            row = await conn.fetchrow(
-                f"INSERT INTO {cls.table_name} ({columns}) "
-                f"VALUES ({placeholders}) "
-                f"RETURNING {returning_cols}",
-                *values.values()
+        async with cls._acquire() as conn:
+            row = await conn.fetchrow(cls._sql("upsert", (tuple(values), tuple(conflict_columns))), *values.values())
+        cls._on_change(dict(row))
+        return dict(row)
+
+    @classmethod
+    async def add_many(cls, records: List[Dict[str, Any]]) -> int:
+        """Insert many records with COPY, all records must have the same keys. Returns the row count"""
+        if not records:
+            return 0
+        columns = tuple(records[0])
+        async with cls._acquire() as conn:
+            result = await conn.copy_records_to_table(
+                cls.table_name, columns=columns, records=[tuple(r[c] for c in columns) for r in records]
             )
-            return dict(row)
+            return int(result.split()[-1])
 
     @classmethod
     async def update(cls, data_id: Union[int, str], **values) -> Optional[Dict[str, Any]]:
@@ -88,42 +261,139 @@ class AsyncBaseDAO:
         if not values:
             raise ValueError("At least one value must be provided for update")
 
-        async with cls._pool.acquire() as conn:
-            set_clause = ", ".join([f"{k} = ${i + 1}" for i, k in enumerate(values.keys())])
-            values_list = list(values.values())
+        async with cls._acquire() as conn:
+            row = await conn.fetchrow(cls._sql("update", tuple(values)), *values.values(), data_id)
+        if row:
+            cls._on_change(dict(row))
+        return dict(row) if row else None
 
-            row = await conn.fetchrow(
-                f"UPDATE {cls.table_name} "
-                f"SET {set_clause} "
-                f"WHERE {cls.pk_column} = ${len(values_list) + 1} "
-                f"RETURNING *",
-                *values_list, data_id
-            )
-            return dict(row) if row else None
+    @classmethod
+    async def update_many(cls, records: List[Dict[str, Any]]):
+        """Update many records by ID in one batch, every record holds the pk and the same other keys"""
+        if not records:
+            return
+        columns = tuple(k for k in records[0] if k != cls.pk_column)
+        async with cls._acquire() as conn:
+            await conn.executemany(cls._sql("update", columns),
+                                   [(*(r[c] for c in columns), r[cls.pk_column]) for r in records])
+        for record in records:
+            cls._on_change(record)
 
     @classmethod
     async def delete(cls, data_id: Union[int, str]) -> bool:
         """Delete record by ID, returns True if any row was affected"""
-        async with cls._pool.acquire() as conn:
-            result = await conn.execute(
-                f"DELETE FROM {cls.table_name} WHERE {cls.pk_column} = $1",
-                data_id
-            )
-            return "DELETE 1" in result
+        async with cls._acquire() as conn:
+            row = await conn.fetchrow(cls._sql("delete"), data_id)
+        if row:
+            cls._on_change(dict(row))
+        return row is not None
+
+    @classmethod
+    async def delete_many(cls, data_ids: List[Union[int, str]]) -> int:
+        """Delete records by IDs, returns the number of deleted rows"""
+        if not data_ids:
+            return 0
+        async with cls._acquire() as conn:
+            rows = await conn.fetch(cls._sql("delete_many"), list(data_ids))
+        for row in rows:
+            cls._on_change(dict(row))
+        return len(rows)
 
 
 class UserDAO(AsyncBaseDAO):
     table_name = "app_users"
     pk_column = "user_id"
+    # add_unique reports a taken username through this index (the violation carries the index name).
+    # Built at startup without CONCURRENTLY: on a big live table create it by hand first,
+    # CREATE UNIQUE INDEX CONCURRENTLY app_users_username_key ON app_users (username), then this is a no-op
+    ddl = "CREATE UNIQUE INDEX IF NOT EXISTS app_users_username_key ON app_users (username)"
+
+    # authenticated users are cached in routers/security.py
+    @classmethod
+    def _on_change(cls, row: Dict[str, Any]):
+        from app.cache import forget_user  # app.cache imports this module
+        forget_user(row, cls.pk_column)
+
+    # user-facing messages for the unique index above, hit by add_unique
+    conflict_messages = {
+        "app_users_username_key": "This username is already taken.",
+    }
 
     # check if the username exists in db
     @classmethod
     async def username_exists(cls, username: str) -> bool:
-        async with cls._pool.acquire() as conn:
+        async with cls._acquire(read=True) as conn:
             exists = await conn.fetchval(f"SELECT 1 FROM {cls.table_name} WHERE username = $1 LIMIT 1", username)
             return bool(exists)
 
 
+class VerdictDAO(AsyncBaseDAO):
+    table_name = "llm_verdicts"
+    pk_column = "cache_key"
+    ddl = (
+        "CREATE TABLE IF NOT EXISTS llm_verdicts ("
+        "cache_key TEXT PRIMARY KEY, "
+        "message TEXT NOT NULL, "
+        "passed BOOLEAN NOT NULL, "
+        "created TIMESTAMPTZ NOT NULL DEFAULT now())"
+    )
+
+
+class RateBucketDAO(AsyncBaseDAO):
+    table_name = "rate_buckets"
+    pk_column = "key"
+    # unlogged: losing buckets on a crash only resets the limits
+    ddl = (
+        "CREATE UNLOGGED TABLE IF NOT EXISTS rate_buckets ("
+        "key TEXT PRIMARY KEY, "
+        "tokens DOUBLE PRECISION NOT NULL, "
+        "allowed BOOLEAN NOT NULL, "
+        "updated TIMESTAMPTZ NOT NULL DEFAULT now())"
+    )
+
+    # refill by elapsed db time, then take `cost` if there is enough, in one statement;
+    # SET expressions all see the old row
+    _take_sql = (
+        "INSERT INTO rate_buckets AS b (key, tokens, allowed) "
+        "VALUES ($1, CASE WHEN $3::float8 >= $2::float8 THEN $3::float8 - $2::float8 ELSE $3::float8 END, "
+        "$3::float8 >= $2::float8) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "allowed = least($3::float8, b.tokens + extract(epoch FROM now() - b.updated) * $4::float8) >= $2::float8, "
+        "tokens = least($3::float8, b.tokens + extract(epoch FROM now() - b.updated) * $4::float8) "
+        "- CASE WHEN least($3::float8, b.tokens + extract(epoch FROM now() - b.updated) * $4::float8) >= $2::float8 "
+        "THEN $2::float8 ELSE 0 END, "
+        "updated = now() "
+        "RETURNING allowed, tokens"
+    )
+
+    @classmethod
+    async def take(cls, key: str, cost: float, capacity: float, rate: float) -> tuple[bool, float]:
+        """Take cost tokens from the bucket, returns (allowed, tokens left)"""
+        async with cls._acquire() as conn:
+            row = await conn.fetchrow(cls._take_sql, key, cost, capacity, rate)
+            return row['allowed'], row['tokens']
+
+    # buckets idle that long are full again, same as absent
+    @classmethod
+    async def delete_idle(cls, idle_sec: float) -> int:
+        async with cls._acquire() as conn:
+            result = await conn.execute(
+                f"DELETE FROM {cls.table_name} WHERE updated < now() - make_interval(secs => $1)", idle_sec)
+            return int(result.split()[-1])
+
+
+# read from the pools at scrape time
+def _pool_gauges() -> dict:
+    stats = AsyncBaseDAO.pool_stats()
+    return {(name, state): stats[name][state] for name in ('primary', 'replica') if name in stats
+            for state in ('size', 'in_use', 'idle')}
+
+
+registry.callback('db_pool_connections', 'Pool connections by state', ('pool', 'state'), _pool_gauges)
+registry.callback('db_acquire_timeouts', 'Gave up waiting for a pool connection', (),
+                  lambda: {(): AsyncBaseDAO.acquire_stats["timeouts"]}, type='counter')
+
+
 if __name__ == '__main__':
     # EXAMPLE
     async def example():
@@ -141,6 +411,12 @@ if __name__ == '__main__':
         exists = await UserDAO.username_exists(username)
         print(f'{username = }, {exists = }')
 
+        # 3. iter_all: rows streamed in chunks, not loaded into one list
+        count = 0
+        async for _ in UserDAO.iter_all(chunk_size=100):
+            count += 1
+        print(f'{count = }')
+
         await AsyncBaseDAO.close_pools()
 
     asyncio.run(example())
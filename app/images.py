@@ -0,0 +1,222 @@
+import io
+import time
+from dataclasses import dataclass
+from itertools import accumulate
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.metrics import registry
+from config import config
+from logger import logger
+
+INK_THRESHOLD = 200  # pixels darker than this are ink
+CROP_PADDING = 8     # px of white margin kept around the ink
+SCREEN_GRID = 32     # the blank check works on a grid of at most this many cells per side
+SCREEN_RASTER = 256  # stroke submissions are rasterized at this size for the blank check
+MAX_SIDE = 4096      # largest accepted canvas / image side, px
+
+# pillow refuses anything past this at open (DecompressionBombError at twice the value)
+Image.MAX_IMAGE_PIXELS = MAX_SIDE * MAX_SIDE
+
+# how many drawings were checked and how many llm calls the blank check saved.
+# prescreen() runs in worker threads, so these are counted by the caller on the event loop (record_prescreen)
+prescreen_stats = {"checked": 0, "rejected": 0}
+
+
+@dataclass
+class Screen:
+    ink_ratio: float     # share of ink pixels
+    bbox_ratio: float    # share of the canvas covered by the ink bounding box
+    strokes: int         # connected groups of ink
+    blank: bool
+
+
+@dataclass
+class Drawing:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    screen: Screen = None
+
+
+# load any upload as grayscale, transparent background becomes white
+def decode(image: bytes) -> Image.Image:
+    try:
+        img = Image.open(io.BytesIO(image))
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e)) from e
+    # size comes from the header: reject before any pixel is decoded
+    if max(img.size) > MAX_SIDE:
+        raise ValueError(f"image too large: {img.width}x{img.height}, max {MAX_SIDE} px per side")
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert('L')
+
+
+# ink bounding box with padding, None for a blank canvas
+def ink_bbox(gray: Image.Image) -> tuple[int, int, int, int] | None:
+    bbox = gray.point(lambda p: 255 if p < INK_THRESHOLD else 0).getbbox()
+    if not bbox:
+        return None
+    left, top, right, bottom = bbox
+    return (max(left - CROP_PADDING, 0), max(top - CROP_PADDING, 0),
+            min(right + CROP_PADDING, gray.width), min(bottom + CROP_PADDING, gray.height))
+
+
+# connected components (8-neighbour) by min-label propagation with pointer jumping
+def count_strokes(ink: np.ndarray) -> int:
+    h, w = ink.shape
+    none = h * w
+    flat_ink = ink.ravel()
+    labels = np.where(ink, np.arange(none).reshape(h, w), none)
+    padded = np.full((h + 2, w + 2), none)
+    for _ in range(none):
+        # 3x3 neighbourhood minimum, done separably: rows then columns
+        padded[1:-1, 1:-1] = labels
+        merged = np.minimum(np.minimum(padded[:-2], padded[1:-1]), padded[2:])
+        merged = np.minimum(np.minimum(merged[:, :-2], merged[:, 1:-1]), merged[:, 2:])
+        # follow each label to its own label: converges in ~log steps instead of ~diameter
+        flat = np.where(flat_ink, merged.ravel(), none)
+        flat = np.append(flat, none)[flat]
+        merged = flat.reshape(h, w)
+        if np.array_equal(merged, labels):
+            break
+        labels = merged
+    return int(np.count_nonzero(labels.ravel() == np.arange(none)))
+
+
+def prescreen(gray: Image.Image) -> Screen:
+    """Cheap blank / near-empty canvas check, meant to run before any llm call."""
+    # box-average the canvas down to a small grid in C, then work on ~1k cells
+    block = max(-(-max(gray.size) // SCREEN_GRID), 1)
+    cells = 255 - np.asarray(gray.reduce(block), dtype=np.int32)  # amount of ink per cell
+    ink = cells > 1
+    ink_ratio = cells.sum() / (255 * cells.size)
+
+    if not ink.any():
+        screen = Screen(ink_ratio=0.0, bbox_ratio=0.0, strokes=0, blank=True)
+    else:
+        rows = np.flatnonzero(ink.any(axis=1))
+        cols = np.flatnonzero(ink.any(axis=0))
+        bbox_ratio = (rows[-1] - rows[0] + 1) * (cols[-1] - cols[0] + 1) / ink.size
+        strokes = count_strokes(ink)
+        blank = (ink_ratio < config.prescreen_min_ink or bbox_ratio < config.prescreen_min_bbox
+                 or strokes < config.prescreen_min_strokes)
+        screen = Screen(ink_ratio=float(ink_ratio), bbox_ratio=float(bbox_ratio), strokes=strokes, blank=bool(blank))
+    return screen
+
+
+def record_prescreen(screen: Screen):
+    prescreen_stats["checked"] += 1
+    prescreen_stats["rejected"] += screen.blank
+
+
+# threshold to 1 bit if asked and encode as optimized png
+def _encode(gray: Image.Image, bw: bool, timings: dict) -> bytes:
+    t = time.perf_counter()
+    if bw:
+        gray = gray.point(lambda p: 255 if p >= INK_THRESHOLD else 0).convert('1')
+    buf = io.BytesIO()
+    gray.save(buf, format='PNG', optimize=True)
+    timings['encode'] = time.perf_counter() - t
+    return buf.getvalue()
+
+
+def _log(source: str, data: bytes, size: tuple[int, int], timings: dict):
+    stages = ', '.join(f'{k} {v * 1000:.1f}ms' for k, v in timings.items())
+    logger.debug(f"normalize drawing: {source} -> {len(data) / 1024:.1f} kb, {size[0]}x{size[1]}, {stages}")
+
+
+def normalize(image: bytes, max_dim: int = None, bw: bool = None) -> Drawing:
+    """Decode, crop to ink, downscale and re-encode a drawing as a compact png."""
+    max_dim = max_dim or config.drawing_max_dim
+    bw = config.drawing_bw if bw is None else bw
+    timings = {}
+
+    t = time.perf_counter()
+    gray = decode(image)
+    timings['decode'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    screen = prescreen(gray)
+    timings['screen'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    bbox = ink_bbox(gray)
+    if bbox:
+        gray = gray.crop(bbox)
+    timings['crop'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    gray.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+    timings['resize'] = time.perf_counter() - t
+
+    data = _encode(gray, bw, timings)
+    _log(f'{len(image) / 1024:.1f} kb', data, gray.size, timings)
+    return Drawing(data=data, mime_type='image/png', width=gray.width, height=gray.height, screen=screen)
+
+
+# stroke points arrive as [x0, y0, dx1, dy1, dx2, dy2, ...]
+def decode_points(points: list[int]) -> list[tuple[int, int]]:
+    return list(zip(accumulate(points[0::2]), accumulate(points[1::2])))
+
+
+def rasterize(strokes: list[tuple[int, bool, list]], box: tuple[int, int, int, int], scale: float) -> Image.Image:
+    """Draw absolute-point strokes (width, erase, points) inside box, scaled."""
+    left, top, right, bottom = box
+    img = Image.new('L', (max(round((right - left) * scale), 1), max(round((bottom - top) * scale), 1)), 255)
+    draw = ImageDraw.Draw(img)
+    for width, erase, points in strokes:
+        color = 255 if erase else 0
+        width = max(round(width * scale), 1)
+        xy = [((x - left) * scale, (y - top) * scale) for x, y in points]
+        if len(xy) > 1:
+            draw.line(xy, fill=color, width=width, joint='curve')
+        # round caps, also draws single-point strokes
+        r = width / 2
+        for x, y in (xy[0], xy[-1]):
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    return img
+
+
+def normalize_strokes(strokes: list[tuple[int, bool, list[int]]], width: int, height: int,
+                      max_dim: int = None, bw: bool = None) -> Drawing:
+    """Rasterize a stroke list straight to the size the llm needs, skipping png decode."""
+    max_dim = max_dim or config.drawing_max_dim
+    bw = config.drawing_bw if bw is None else bw
+    timings = {}
+
+    t = time.perf_counter()
+    strokes = [(w, e, decode_points(p)) for w, e, p in strokes if len(p) >= 2]
+    timings['decode'] = time.perf_counter() - t
+
+    # blank check on a small copy of the whole canvas
+    t = time.perf_counter()
+    canvas = (0, 0, width, height)
+    screen = prescreen(rasterize(strokes, canvas, min(SCREEN_RASTER / max(width, height), 1)))
+    timings['screen'] = time.perf_counter() - t
+
+    # ink bounding box straight from the points
+    t = time.perf_counter()
+    box = canvas
+    drawn = [(w, points) for w, e, points in strokes if not e]
+    if drawn:
+        pad = max(w for w, _ in drawn) / 2 + CROP_PADDING
+        xs = [x for _, points in drawn for x, _ in points]
+        ys = [y for _, points in drawn for _, y in points]
+        box = (max(min(xs) - pad, 0), max(min(ys) - pad, 0), min(max(xs) + pad, width), min(max(ys) + pad, height))
+    gray = rasterize(strokes, box, min(max_dim / max(box[2] - box[0], box[3] - box[1], 1), 1))
+    timings['rasterize'] = time.perf_counter() - t
+
+    data = _encode(gray, bw, timings)
+    _log(f'{len(strokes)} strokes', data, gray.size, timings)
+    return Drawing(data=data, mime_type='image/png', width=gray.width, height=gray.height, screen=screen)
+
+
+registry.callback('drawing_prescreen', 'Drawings checked by the blank pre-screen, rejected ones saved an llm call',
+                  ('result',), lambda: {('checked',): prescreen_stats["checked"],
+                                        ('rejected',): prescreen_stats["rejected"]}, type='counter')
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from logger import logger
+
+
+@dataclass
+class Job:
+    id: str
+    seq: int                        # order of arrival, gives the queue position
+    args: tuple
+    status: str = 'queued'          # queued -> running -> done
+    result: dict = None
+    status_code: int = None
+    created: float = field(default_factory=time.monotonic)
+    finished: float = None
+
+
+class JobQueue:
+    """Bounded queue of drawing evaluations drained by a fixed pool of workers."""
+
+    def __init__(self, handler: Callable[..., Awaitable[tuple[dict, int]]], workers: int, maxsize: int, ttl: float):
+        self.handler = handler          # async (*job.args) -> (result, status_code)
+        self.workers = workers          # also the cap on concurrent provider calls
+        self.ttl = ttl                  # how long finished jobs can be polled
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._jobs: dict[str, Job] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._submitted = 0
+        self._taken = 0
+        self._avg_duration = 5.0        # ewma of job run time, сек
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work(), name=f'job-worker-{i}') for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, *args) -> Job | None:
+        """Enqueue a job, None if the queue is full."""
+        self._cleanup()
+        if self._queue.full():
+            return None
+        self._submitted += 1
+        job = Job(id=uuid.uuid4().hex, seq=self._submitted, args=args)
+        self._queue.put_nowait(job)
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int:
+        """Place in the queue (1 = next to run), 0 once running or done."""
+        return max(job.seq - self._taken, 0) if job.status == 'queued' else 0
+
+    def retry_after(self) -> int:
+        """Rough seconds until the queue has room again."""
+        return max(round(self._avg_duration * self._queue.qsize() / self.workers), 1)
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            self._taken = job.seq
+            job.status = 'running'
+            start_time = time.monotonic()
+            try:
+                job.result, job.status_code = await self.handler(*job.args)
+            except Exception as e:
+                logger.error(f"job {job.id} failed: {type(e).__name__}('{e}')")
+                job.result, job.status_code = {"error": str(e)}, 500
+            job.status = 'done'
+            job.finished = time.monotonic()
+            self._avg_duration += 0.2 * (job.finished - start_time - self._avg_duration)
+            self._queue.task_done()
+
+    # forget finished jobs nobody polled for ttl seconds; dict keeps arrival order
+    def _cleanup(self):
+        now = time.monotonic()
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if job.status == 'done' and now - job.finished > self.ttl:
+                del self._jobs[job_id]
+            elif now - job.created <= self.ttl:
+                break
@@ -0,0 +1,242 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Callable
+
+from config import config
+from logger import logger
+
+# latency buckets, сек
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Metrics are only touched from the event loop thread, so there are no locks.
+# labels() returns the same child object for the same values: hot paths can look it up once and keep it.
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """(suffix, label names, label values, value) for every series"""
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, names, values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_labels(names, values)} {_number(value)}')
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in self._children.items():
+            yield '_total', self.labelnames, values, child.value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self):
+        for values, child in self._children.items():
+            yield '', self.labelnames, values, child.value
+
+
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    # counts are kept per bucket and only made cumulative here, at scrape time
+    def samples(self):
+        names = self.labelnames + ('le',)
+        for values, child in self._children.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                total += count
+                yield '_bucket', names, values + ('+Inf' if bound == float('inf') else _number(bound),), total
+            yield '_sum', self.labelnames, values, child.sum
+            yield '_count', self.labelnames, values, total
+
+
+class Callback(Metric):
+    """Values read from elsewhere at scrape time: fn() -> {label values: value}"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple, fn: Callable[[], dict], type: str = 'gauge'):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        self.type = type
+
+    def samples(self):
+        suffix = '_total' if self.type == 'counter' else ''
+        for values, value in self.fn().items():
+            yield suffix, self.labelnames, values, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def _add(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, labelnames: tuple, fn: Callable[[], dict], type: str = 'gauge'):
+        return self._add(Callback(name, help, labelnames, fn, type))
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines += metric.render()
+            except Exception as e:
+                logger.warning(f"metric {metric.name}: {type(e).__name__}('{e}')")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# http
+http_requests = registry.histogram('http_request_duration_seconds', 'HTTP request latency',
+                                   ('route', 'method', 'status'))
+
+# llm providers
+llm_requests = registry.counter('llm_requests', 'LLM provider calls by http status', ('provider', 'model', 'status'))
+llm_latency = registry.histogram('llm_request_duration_seconds', 'LLM provider call latency', ('provider', 'model'))
+llm_tokens = registry.counter('llm_tokens', 'Tokens reported by the provider', ('provider', 'model', 'kind'))
+llm_attempts = registry.counter('llm_attempts', 'Grading attempts by outcome: verdict, no_verdict, error, timeout',
+                                ('provider', 'outcome'))
+llm_unparsed = registry.counter('llm_unparsed_answers', 'Answers that do not start with a verdict', ('source',))
+verdicts = registry.counter('drawing_verdicts', 'Graded drawings by result: passed, failed, timeout', ('result',))
+
+# db
+db_acquire_wait = registry.histogram('db_acquire_wait_seconds', 'Time waiting for a pool connection',
+                                     buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+
+def record_llm(provider: str, model: str, seconds: float, status_code: int, usage: tuple[int, int] = None):
+    """One provider call; usage is (prompt tokens, completion tokens) if the provider reported it"""
+    llm_requests.labels(provider, model, status_code).inc()
+    llm_latency.labels(provider, model).observe(seconds)
+    if usage:
+        llm_tokens.labels(provider, model, 'prompt').inc(usage[0] or 0)
+        llm_tokens.labels(provider, model, 'completion').inc(usage[1] or 0)
+
+
+def record_verdict(passed: bool | None):
+    verdicts.labels('timeout' if passed is None else 'passed' if passed else 'failed').inc()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a sleeping task, a direct sign of blocking code."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lag = registry.histogram('event_loop_lag_seconds', 'Event loop wake-up delay',
+                                      buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+        self._task: asyncio.Task = None
+
+    async def _run(self):
+        while True:
+            start_time = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(time.perf_counter() - start_time - self.interval, 0))
+
+    async def start(self):
+        if self.interval and not self._task:
+            self._task = asyncio.create_task(self._run(), name='loop-lag-monitor')
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+loop_lag = LoopLagMonitor(config.metrics_loop_lag_interval)
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from app.metrics import registry
+from config import config
+
+
+class HasherBusy(Exception):
+    """Too many hashing requests already waiting."""
+
+
+class PasswordHasher:
+    """Runs bcrypt in a small thread pool so it never blocks the event loop."""
+
+    def __init__(self, rounds: int, workers: int, max_queue: int):
+        # hashes made with other rounds still verify and get upgraded on login
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.stats = {"calls": 0, "rejected": 0, "max_queued": 0}
+        self._in_flight = 0     # submitted and not finished, counted on the event loop
+        self._running = 0       # being hashed right now, counted by the worker threads
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a free worker thread."""
+        return self._in_flight - self._running
+
+    async def _run(self, fn, *args):
+        if self.queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise HasherBusy()
+        self.stats["calls"] += 1
+        self._in_flight += 1
+        self.stats["max_queued"] = max(self.stats["max_queued"], self.queued)
+
+        def job():
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            self._in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple[bool, str | None]:
+        """(is valid, new hash if the stored one uses outdated parameters)"""
+        return await self._run(self.context.verify_and_update, password, hashed)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+hasher = PasswordHasher(rounds=config.bcrypt_rounds, workers=config.hash_workers, max_queue=config.hash_max_queue)
+registry.callback('password_hash_queue', 'Password hashing: requests waiting now and the most ever waiting',
+                  ('state',), lambda: {('queued',): hasher.queued, ('max_queued',): hasher.stats["max_queued"]})
+registry.callback('password_hash_requests', 'Password hashing requests: run, or rejected with 503 (queue full)',
+                  ('result',), lambda: {('run',): hasher.stats["calls"], ('rejected',): hasher.stats["rejected"]},
+                  type='counter')
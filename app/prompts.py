@@ -0,0 +1,103 @@
+import hashlib
+import os
+import time
+
+from config import config
+from logger import logger
+
+
+class PromptRegistry:
+    """Prompt templates loaded once, formatted once per version/item/language, reloaded when the file changes.
+
+    Version "default" lives in prompt.txt, any other version "x" in prompt.x.txt.
+    Several versions can run side by side for A/B comparison, weighted by `versions`.
+    """
+
+    def __init__(self, versions: dict[str, float], directory: str = '.', check_interval: float = 1.0):
+        self.versions = versions
+        self.directory = directory
+        self.check_interval = check_interval
+        self._templates: dict[str, str] = {}
+        self._mtimes: dict[str, float] = {}
+        self._compiled: dict[tuple[str, str, str], str] = {}
+        self._checked = 0.0
+        # per version: calls, passed verdicts and prompt size (chars) as a token cost proxy
+        self.stats = {v: {"calls": 0, "passed": 0, "chars": 0} for v in versions}
+
+    def _path(self, version: str) -> str:
+        name = 'prompt.txt' if version == 'default' else f'prompt.{version}.txt'
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        for version in self.versions:
+            path = self._path(version)
+            try:
+                mtime = os.stat(path).st_mtime
+                if self._mtimes.get(version) == mtime:
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._templates[version] = f.read()
+                self._mtimes[version] = mtime
+                logger.info(f"prompt {version} loaded from {path}")
+            except OSError as e:
+                logger.error(f"prompt {version}: {e}")
+        self._compiled.clear()
+        self._checked = time.monotonic()
+
+    # at most one stat per file per check_interval
+    def _maybe_reload(self):
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+        self._checked = time.monotonic()
+        for version in self.versions:
+            try:
+                if os.stat(self._path(version)).st_mtime != self._mtimes.get(version):
+                    self.load()
+                    return
+            except OSError:
+                pass
+
+    # same key always gets the same version, so a drawing is never graded by two prompts
+    def pick_version(self, key: str) -> str:
+        if len(self.versions) == 1:
+            return next(iter(self.versions))
+        point = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=4).digest(), 'big') / 2 ** 32
+        total = sum(self.versions.values())
+        for version, weight in self.versions.items():
+            point -= weight / total
+            if point < 0:
+                return version
+        return version
+
+    def get(self, item_name: str, language: str, key: str = '') -> tuple[str, str]:
+        """Returns (version, prompt text)."""
+        self._maybe_reload()
+        version = self.pick_version(key)
+        compiled_key = (version, item_name, language)
+        prompt = self._compiled.get(compiled_key)
+        if prompt is None:
+            if version not in self._templates:
+                raise FileNotFoundError(self._path(version))
+            prompt = self._templates[version].format(item_name=item_name, language=language)
+            if len(self._compiled) >= 1024:  # item_name comes from the client
+                self._compiled.clear()
+            self._compiled[compiled_key] = prompt
+        return version, prompt
+
+    def record(self, version: str, prompt: str, passed: bool):
+        stats = self.stats[version]
+        stats["calls"] += 1
+        stats["passed"] += passed
+        stats["chars"] += len(prompt)
+
+
+# "default:1" or "default:0.8,short:0.2"
+def parse_versions(value: str) -> dict[str, float]:
+    versions = {}
+    for pair in value.split(','):
+        name, _, weight = pair.strip().partition(':')
+        versions[name] = float(weight or 1)
+    return versions
+
+
+prompts = PromptRegistry(parse_versions(config.prompt_versions), directory=config.prompt_dir)
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+from app import dao
+from app.cache import TTLCache
+from config import config
+from logger import logger
+
+
+class MemoryBuckets:
+    """Token buckets in this process only, each uvicorn worker counts on its own."""
+
+    def __init__(self, maxsize: int = 100_000):
+        self._buckets = TTLCache(maxsize=maxsize, ttl=3600)  # key -> (tokens, updated)
+
+    async def take(self, key: str, cost: float, capacity: float, rate: float) -> tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        # a bucket that has refilled is the same as no bucket
+        self._buckets.set(key, (tokens, now), ttl=(capacity - tokens) / rate + 1)
+        return allowed, tokens
+
+    async def cleanup(self, idle_sec: float):
+        pass
+
+
+class SQLiteBuckets:
+    """Token buckets in a local sqlite file shared by all workers on this host.
+
+    Meant for a tmpfs path like /dev/shm, so it is shared memory in practice.
+    """
+
+    TAKE_SQL = (
+        "INSERT INTO rate_buckets (key, tokens, allowed, updated) "
+        "VALUES (?1, CASE WHEN ?3 >= ?2 THEN ?3 - ?2 ELSE ?3 END, ?3 >= ?2, ?5) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "allowed = min(?3, tokens + (?5 - updated) * ?4) >= ?2, "
+        "tokens = min(?3, tokens + (?5 - updated) * ?4) "
+        "- CASE WHEN min(?3, tokens + (?5 - updated) * ?4) >= ?2 THEN ?2 ELSE 0 END, "
+        "updated = ?5 "
+        "RETURNING allowed, tokens"
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._conn:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=0.2)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets ("
+                         "key TEXT PRIMARY KEY, tokens REAL NOT NULL, allowed INTEGER NOT NULL, updated REAL NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def _take(self, key: str, cost: float, capacity: float, rate: float) -> tuple[bool, float]:
+        allowed, tokens = self._connect().execute(self.TAKE_SQL, (key, cost, capacity, rate, time.time())).fetchone()
+        return bool(allowed), tokens
+
+    # sqlite waits on the file lock, keep that off the event loop
+    async def take(self, key: str, cost: float, capacity: float, rate: float) -> tuple[bool, float]:
+        return await asyncio.to_thread(self._take, key, cost, capacity, rate)
+
+    async def cleanup(self, idle_sec: float):
+        await asyncio.to_thread(
+            lambda: self._connect().execute("DELETE FROM rate_buckets WHERE updated < ?", (time.time() - idle_sec,)))
+
+
+class PostgresBuckets:
+    """Token buckets in the app database, one limit for the whole cluster."""
+
+    async def take(self, key: str, cost: float, capacity: float, rate: float) -> tuple[bool, float]:
+        return await dao.RateBucketDAO.take(key, cost, capacity, rate)
+
+    async def cleanup(self, idle_sec: float):
+        await dao.RateBucketDAO.delete_idle(idle_sec)
+
+
+class RateLimiter:
+    """Cost-weighted token bucket per client key: a request costs tokens by path, buckets refill at `rate`/sec."""
+
+    def __init__(self, backend, capacity: float, rate: float, costs: dict[str, float], default_cost: float = 1.0):
+        self.backend = backend
+        self.capacity = capacity
+        self.rate = rate
+        # "POST /api/jobs" prices one method, "/api/jobs" any; longest prefix first, a method rule before a bare one
+        rules = []
+        for key, cost in costs.items():
+            method, _, prefix = key.rpartition(' ')
+            rules.append((method.upper() or None, prefix, cost))
+        self.costs = sorted(rules, key=lambda rule: (len(rule[1]), rule[0] is not None), reverse=True)
+        self.default_cost = default_cost
+        self.idle_sec = capacity / rate     # an untouched bucket is full after that
+        self._cleaned = time.monotonic()
+        self.stats = {"allowed": 0, "limited": 0, "errors": 0}
+
+    def cost(self, path: str, method: str = 'GET') -> float:
+        for rule_method, prefix, cost in self.costs:
+            if path.startswith(prefix) and rule_method in (None, method):
+                return cost
+        return self.default_cost
+
+    async def take(self, key: str, cost: float) -> tuple[bool, float]:
+        """(allowed, seconds until cost tokens are available again)"""
+        try:
+            allowed, tokens = await self.backend.take(key, cost, self.capacity, self.rate)
+            await self._maybe_cleanup()
+        except Exception as e:
+            # fail open, a broken limiter should not take the site down
+            self.stats["errors"] += 1
+            logger.warning(f"rate limit backend error: {type(e).__name__}('{e}')")
+            return True, 0.0
+        self.stats["allowed" if allowed else "limited"] += 1
+        return allowed, 0.0 if allowed else (min(cost, self.capacity) - tokens) / self.rate
+
+    async def _maybe_cleanup(self):
+        if time.monotonic() - self._cleaned > max(self.idle_sec, 60):
+            self._cleaned = time.monotonic()
+            await self.backend.cleanup(self.idle_sec)
+
+
+# "/static:0,POST /api/submit-drawing:10"
+def parse_costs(value: str) -> dict[str, float]:
+    costs = {}
+    for pair in value.split(','):
+        if pair.strip():
+            prefix, _, cost = pair.strip().rpartition(':')
+            costs[prefix] = float(cost)
+    return costs
+
+
+def create_backend(name: str):
+    if name == 'postgres':
+        return PostgresBuckets()
+    if name == 'sqlite':
+        return SQLiteBuckets(config.rate_limit_sqlite_path)
+    if name == 'memory':
+        # every worker would enforce the limit on its own: N workers, N times the budget.
+        # uvicorn and gunicorn both take the worker count from WEB_CONCURRENCY
+        workers = os.environ.get('WEB_CONCURRENCY', '1')
+        if workers.isdigit() and int(workers) > 1:
+            raise RuntimeError(f"rate_limit_backend=memory with WEB_CONCURRENCY={workers}: "
+                               f"use sqlite (one host) or postgres (cluster)")
+        return MemoryBuckets()
+    raise ValueError(f"unknown rate_limit_backend {name!r}: postgres, sqlite or memory")
+
+
+limiter = RateLimiter(create_backend(config.rate_limit_backend), capacity=config.rate_limit_capacity,
+                      rate=config.rate_limit_refill, costs=parse_costs(config.rate_limit_costs))
@@ -0,0 +1,77 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+
+from app.ai import has_user_passed_task
+from app.metrics import llm_attempts, llm_unparsed
+from config import config
+from logger import logger
+
+
+@dataclass
+class LLMVerdict:
+    message: str | None          # ответ нейросети
+    passed: bool | None          # None если так и не получили внятный ответ
+    attempts: int = 0
+    provider: str | None = None  # кто дал ответ
+    timed_out: bool = False      # вышли за дедлайн или исчерпали попытки
+
+
+class LLMRetry:
+    """Asks providers in turn until one gives a verdict, within a deadline and an attempt budget."""
+
+    def __init__(self, providers: list, deadline: float = None, max_attempts: int = None,
+                 backoff_base: float = None, backoff_max: float = None):
+        self.providers = providers
+        self.deadline = deadline or config.llm_deadline_sec
+        self.max_attempts = max_attempts or config.llm_max_attempts
+        self.backoff_base = backoff_base or config.llm_backoff_base
+        self.backoff_max = backoff_max or config.llm_backoff_max
+
+    # full jitter: random pause up to the exponential cap
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    async def ask(self, conversation: list, deadline: float = None) -> LLMVerdict:
+        """deadline: seconds left for this drawing if part of the budget is already spent, default self.deadline"""
+        started = time.monotonic()
+        deadline = self.deadline if deadline is None else deadline
+        verdict = LLMVerdict(message=None, passed=None)
+
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+
+            # failover: the next attempt goes to the next provider
+            llm = self.providers[(attempt - 1) % len(self.providers)]
+            name = type(llm).__name__
+            verdict.attempts = attempt
+            try:
+                llm_response: str = await asyncio.wait_for(llm.parse_answer(conversation), timeout=remaining)
+            except asyncio.TimeoutError:
+                llm_attempts.labels(name, 'timeout').inc()
+                logger.warning(f"LLM {name} attempt {attempt}: deadline exceeded")
+                break
+            except Exception as e:
+                llm_attempts.labels(name, 'error').inc()
+                logger.warning(f"LLM {name} attempt {attempt}: {type(e).__name__}('{e}')")
+            else:
+                passed = has_user_passed_task(llm_response=llm_response)
+                if passed is not None:
+                    llm_attempts.labels(name, 'verdict').inc()
+                    verdict.message, verdict.passed, verdict.provider = llm_response, passed, name
+                    return verdict
+                llm_attempts.labels(name, 'no_verdict').inc()
+                llm_unparsed.labels('retry').inc()
+                logger.warning(f"LLM {name} attempt {attempt}: no verdict in {llm_response[:100]!r}")
+
+            # wait before the next attempt, but never past the deadline
+            if attempt < self.max_attempts:
+                pause = min(self._backoff(attempt), deadline - (time.monotonic() - started))
+                if pause > 0:
+                    await asyncio.sleep(pause)
+
+        verdict.timed_out = True
+        return verdict
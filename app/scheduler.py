@@ -0,0 +1,87 @@
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from logger import logger
+
+EWMA_ALPHA = 0.3   # weight of the newest sample
+FAILURE_LATENCY = 10.0  # latency charged for a failed call if it failed faster, сек
+
+
+@dataclass
+class ModelStats:
+    latency: float = 0.0                # ewma, сек
+    error_rate: float = 0.0             # ewma of 0/1 outcomes
+    calls: int = 0
+    throttled: int = 0                  # 429 count
+    consecutive_errors: int = 0
+    cooldown_until: float = 0.0         # circuit breaker is open until this time
+    remaining: int | None = None        # quota left as reported by the provider
+    sent: deque = field(default_factory=deque)  # send times within the last minute
+
+
+class ModelScheduler:
+    """Routes requests to the healthiest model: lowest latency and error rate, not throttled."""
+
+    def __init__(self, models: list[str], rpm: int, breaker_errors: int, cooldown: float,
+                 failure_latency: float = FAILURE_LATENCY):
+        self.models = models
+        self.rpm = rpm
+        self.breaker_errors = breaker_errors
+        self.cooldown = cooldown
+        self.failure_latency = failure_latency
+        self.stats = {m: ModelStats() for m in models}
+
+    def _available(self, model: str, now: float) -> bool:
+        s = self.stats[model]
+        while s.sent and now - s.sent[0] > 60:
+            s.sent.popleft()
+        return now >= s.cooldown_until and len(s.sent) < self.rpm
+
+    # lower is better; unseen models score 0 so each one gets probed
+    @staticmethod
+    def _score(s: ModelStats) -> float:
+        return s.latency * (1 + 4 * s.error_rate)
+
+    def pick(self) -> str:
+        now = time.monotonic()
+        candidates = [m for m in self.models if self._available(m, now)]
+        if candidates:
+            model = min(candidates, key=lambda m: self._score(self.stats[m]))
+        else:
+            # everything is throttled: take the one that recovers first
+            model = min(self.models, key=lambda m: (self.stats[m].cooldown_until, len(self.stats[m].sent)))
+        self.stats[model].sent.append(now)
+        return model
+
+    def record(self, model: str, latency: float, status_code: int, headers: dict = None):
+        s = self.stats[model]
+        s.calls += 1
+        failed = status_code != 200
+        s.error_rate += EWMA_ALPHA * (failed - s.error_rate)
+
+        remaining = (headers or {}).get('x-ratelimit-remaining-requests')
+        if remaining is not None and remaining.isdigit():
+            s.remaining = int(remaining)
+            if s.remaining == 0:
+                s.cooldown_until = max(s.cooldown_until, time.monotonic() + 60)
+
+        # a failure is charged at least failure_latency, otherwise a model that fails fast
+        # (or has never succeeded) would look like the quickest one
+        sample = max(latency, self.failure_latency) if failed else latency
+        s.latency = sample if not s.latency else s.latency + EWMA_ALPHA * (sample - s.latency)
+        if not failed:
+            s.consecutive_errors = 0
+            return
+
+        s.consecutive_errors += 1
+        if status_code == 429:
+            s.throttled += 1
+            retry_after = (headers or {}).get('retry-after')
+            pause = float(retry_after) if retry_after and retry_after.isdigit() else self.cooldown
+            s.cooldown_until = time.monotonic() + pause
+            s.remaining = None
+            logger.warning(f"model {model} throttled, cooldown {pause}s")
+        elif s.consecutive_errors >= self.breaker_errors:
+            s.cooldown_until = time.monotonic() + self.cooldown
+            logger.warning(f"model {model} failed {s.consecutive_errors} times in a row, cooldown {self.cooldown}s")
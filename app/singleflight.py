@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight call and its result (or exception)."""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None or task.cancelled():
+            self.stats["calls"] += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.stats["shared"] += 1
+
+        self._waiters[key] += 1
+        try:
+            # shield: one cancelled waiter must not cancel the call for the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # the last waiter gone: nobody needs the result anymore. Forget the key right away,
+            # a caller arriving before the task has finished cancelling must start a new call
+            if self._waiters.get(key) == 1 and not task.done():
+                task.cancel()
+                self._forget(key, task)
+            raise
+        finally:
+            if key in self._waiters and self._calls.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+        # mark the exception as retrieved if every waiter has been cancelled
+        if task.done() and not task.cancelled():
+            task.exception()
+
+    def __len__(self):
+        return len(self._calls)
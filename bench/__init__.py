@@ -0,0 +1,3 @@
+# users created by bench.fixture and logged in by the /token scenario of bench.load
+USER_PREFIX = 'bench_'
+PASSWORD = 'bench-password'
@@ -0,0 +1,160 @@
+"""Local stand-in for the Gemini and Groq (OpenAI-compatible) APIs used in app/ai.py.
+
+Answers after a lognormal delay, fails with 500 or 429 at the given rates and sometimes
+answers without a verdict, so retries, failover and the model scheduler all get exercised.
+Point the app at it with
+
+    gemini_base_url=http://127.0.0.1:9100/v1beta groq_base_url=http://127.0.0.1:9100/openai/v1
+
+    python -m bench.fake_llm [--port 9100] [--latency-ms 800] [--sigma 0.5]
+                             [--error-rate 0.02] [--rate-429 0.05] [--unparsed-rate 0.02]
+"""
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import dataclass
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+ANSWERS = [
+    "✅ Nice drawing, it clearly shows the {item}.",
+    "❌ This does not look like a {item}, try adding more details.",
+    "✅ Great job, the {item} is easy to recognize.",
+    "❌ Hard to tell what this is, the {item} needs a clearer shape.",
+]
+UNPARSED = "I think this could be a {item}, but I am not sure."
+
+
+@dataclass
+class Behaviour:
+    latency_ms: float = 800         # median
+    sigma: float = 0.5              # lognormal spread, 0 = fixed latency
+    error_rate: float = 0.02        # share of 500s
+    rate_429: float = 0.05          # share of 429s
+    unparsed_rate: float = 0.02     # share of answers without ✅/❌
+    chunks: int = 4                 # pieces per streamed answer
+
+
+behaviour = Behaviour()
+stats = {"requests": 0, "errors": 0, "throttled": 0}
+
+
+def delay() -> float:
+    return behaviour.latency_ms / 1000 * random.lognormvariate(0, behaviour.sigma)
+
+
+def answer(item: str = 'drawing') -> str:
+    if random.random() < behaviour.unparsed_rate:
+        return UNPARSED.format(item=item)
+    return random.choice(ANSWERS).format(item=item)
+
+
+# 500 or 429 by the configured rates, None for a normal answer
+def failure() -> JSONResponse | None:
+    stats["requests"] += 1
+    roll = random.random()
+    if roll < behaviour.rate_429:
+        stats["throttled"] += 1
+        return JSONResponse({"error": {"code": 429, "message": "Resource has been exhausted"}}, status_code=429,
+                            headers={"retry-after": "1", "x-ratelimit-remaining-requests": "0"})
+    if roll < behaviour.rate_429 + behaviour.error_rate:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"code": 500, "message": "Internal error"}}, status_code=500)
+    return None
+
+
+def split(text: str) -> list[str]:
+    size = max(len(text) // behaviour.chunks, 1)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def usage_tokens(body: bytes, text: str) -> tuple[int, int]:
+    # rough, ~4 bytes per token; images count by size too
+    return len(body) // 4, len(text) // 4
+
+
+async def gemini(request: Request):
+    body = await request.body()
+    await asyncio.sleep(delay())
+    if error := failure():
+        return error
+    text = answer()
+    prompt_tokens, completion_tokens = usage_tokens(body, text)
+    usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": completion_tokens,
+             "totalTokenCount": prompt_tokens + completion_tokens}
+
+    def chunk(piece: str) -> dict:
+        return {"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}], "usageMetadata": usage}
+
+    if request.url.path.endswith(':streamGenerateContent'):
+        async def events():
+            for piece in split(text):
+                yield f"data: {json.dumps(chunk(piece), ensure_ascii=False)}\r\n\r\n"
+                await asyncio.sleep(0.02)
+        return StreamingResponse(events(), media_type='text/event-stream')
+    return JSONResponse(chunk(text))
+
+
+async def openai_chat(request: Request):
+    body = await request.body()
+    payload = json.loads(body)
+    await asyncio.sleep(delay())
+    if error := failure():
+        return error
+    text = answer()
+    prompt_tokens, completion_tokens = usage_tokens(body, text)
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+             "total_tokens": prompt_tokens + completion_tokens}
+
+    if payload.get("stream"):
+        async def events():
+            pieces = split(text)
+            for i, piece in enumerate(pieces):
+                data = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                if i == len(pieces) - 1:
+                    data["x_groq"] = {"usage": usage}
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(0.02)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type='text/event-stream')
+    return JSONResponse({"choices": [{"index": 0, "message": {"role": "assistant", "content": text}}],
+                         "model": payload.get("model"), "usage": usage})
+
+
+async def get_stats(request: Request):
+    return JSONResponse(stats)
+
+
+app = Starlette(routes=[
+    Route("/v1beta/models/{model}:generateContent", gemini, methods=["POST"]),
+    Route("/v1beta/models/{model}:streamGenerateContent", gemini, methods=["POST"]),
+    Route("/openai/v1/chat/completions", openai_chat, methods=["POST"]),
+    Route("/stats", get_stats),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fake Gemini / Groq API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=behaviour.latency_ms)
+    parser.add_argument('--sigma', type=float, default=behaviour.sigma)
+    parser.add_argument('--error-rate', type=float, default=behaviour.error_rate)
+    parser.add_argument('--rate-429', type=float, default=behaviour.rate_429)
+    parser.add_argument('--unparsed-rate', type=float, default=behaviour.unparsed_rate)
+    parser.add_argument('--seed', type=int, default=None, help="fixed seed for reproducible runs")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    behaviour.latency_ms, behaviour.sigma = args.latency_ms, args.sigma
+    behaviour.error_rate, behaviour.rate_429, behaviour.unparsed_rate = args.error_rate, args.rate_429, args.unparsed_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
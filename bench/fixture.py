@@ -0,0 +1,52 @@
+"""Postgres fixture for benchmarks: creates app_users and seeds bench users.
+
+Uses the app's own db settings (host, dbname, user, password, port), for example a throwaway
+
+    docker run --rm -e POSTGRES_USER=u -e POSTGRES_PASSWORD=p -e POSTGRES_DB=d -p 5432:5432 postgres:16
+
+    python -m bench.fixture [--users 1000]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+
+from app.dao import AsyncBaseDAO, UserDAO
+from app.passwords import hasher
+from bench import PASSWORD, USER_PREFIX
+
+SCHEMA = os.path.join(os.path.dirname(__file__), 'schema.sql')
+
+
+async def seed(users: int):
+    await AsyncBaseDAO.initialize_pools()
+    try:
+        with open(SCHEMA, 'r', encoding='utf-8') as f:
+            await AsyncBaseDAO._pool.execute(f.read())
+        deleted = await AsyncBaseDAO._pool.execute(
+            f"DELETE FROM {UserDAO.table_name} WHERE username LIKE $1", USER_PREFIX + '%')
+        print(f"removed old bench users: {deleted}")
+
+        # one hash for everyone, bcrypt is the slow part of login not of seeding
+        password = await hasher.hash(PASSWORD)
+        created = datetime.datetime.now()
+        count = await UserDAO.add_many([
+            {"username": f"{USER_PREFIX}{i}", "password": password, "birth_year": 1990,
+             "email": f"{USER_PREFIX}{i}@example.com", "fullname": f"Bench User {i}", "created": created}
+            for i in range(users)
+        ])
+        print(f"created {count} bench users")
+    finally:
+        await AsyncBaseDAO.close_pools()
+        hasher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="create app_users and seed bench users")
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(seed(args.users))
+
+
+if __name__ == '__main__':
+    main()
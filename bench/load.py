@@ -0,0 +1,293 @@
+"""Load test: runs the app against bench.fake_llm and reports throughput, latency, loop lag and memory.
+
+Starts the fake provider and the app (uvicorn, one worker) as subprocesses unless --app-url is given.
+The app needs Postgres to start, from the usual env settings (host, dbname, user, password, port),
+and the token scenario needs the bench users. A throwaway database:
+
+    docker run --rm -e POSTGRES_USER=u -e POSTGRES_PASSWORD=p -e POSTGRES_DB=d -p 5432:5432 postgres:16
+    python -m bench.fixture
+
+The app is pointed at bench/prompt.txt, so no real prompt is needed.
+Results are printed and saved as json (default bench/results/) for comparing runs.
+
+    python -m bench.load [--scenario drawings:200:100 --scenario token:500:50 ...] [--out results.json]
+
+Scenario is name:requests:concurrency, concurrency = requests makes a burst.
+    drawings    POST /api/submit-drawing, every drawing different so none come from the cache
+    token       POST /token for the seeded bench users (bcrypt bound)
+    pages       GET /, /draw and /auth
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import asyncpg
+import httpx
+
+from bench import PASSWORD, USER_PREFIX
+
+DEFAULT_SCENARIOS = ['pages:2000:50', 'token:300:30', 'drawings:200:100']
+ITEMS = ['car', 'house', 'cat', 'tree', 'sun', 'fish']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# a few random polylines, canvas 400x400, in the /submit-drawing strokes format
+def drawing_payload(rng: random.Random) -> dict:
+    strokes = []
+    for _ in range(rng.randint(2, 6)):
+        x, y = rng.randint(50, 350), rng.randint(50, 350)
+        points = [x, y]
+        for _ in range(rng.randint(5, 30)):
+            dx, dy = rng.randint(-12, 12), rng.randint(-12, 12)
+            if 0 <= x + dx < 400 and 0 <= y + dy < 400:
+                x, y = x + dx, y + dy
+                points += [dx, dy]
+        strokes.append({"w": 4, "p": points})
+    return {"strokes": strokes, "width": 400, "height": 400, "item_name": rng.choice(ITEMS), "language": "en"}
+
+
+async def drawings(client: httpx.AsyncClient, i: int, rng: random.Random, args) -> httpx.Response:
+    return await client.post('/api/submit-drawing', json=drawing_payload(rng))
+
+
+async def token(client: httpx.AsyncClient, i: int, rng: random.Random, args) -> httpx.Response:
+    return await client.post('/token', data={"username": f"{USER_PREFIX}{i % args.users}", "password": PASSWORD})
+
+
+async def pages(client: httpx.AsyncClient, i: int, rng: random.Random, args) -> httpx.Response:
+    return await client.get(rng.choice(['/', '/draw', '/auth']))
+
+
+SCENARIOS = {"drawings": drawings, "token": token, "pages": pages}
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+# closed loop: `concurrency` clients, each sends its next request as soon as the previous one is answered
+async def run_scenario(client: httpx.AsyncClient, name: str, requests: int, concurrency: int, args) -> dict:
+    fn = SCENARIOS[name]
+    rng = random.Random(args.seed)
+    latencies, statuses = [], Counter()
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start_time = time.perf_counter()
+            try:
+                r = await fn(client, i, rng, args)
+                statuses[str(r.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, requests))])
+    duration = time.perf_counter() - start_time
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 2)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "duration_sec": round(duration, 3),
+        "rps": round(requests / duration, 2),
+        "latency_ms": {"mean": ms(sum(latencies) / len(latencies)), "p50": ms(percentile(latencies, 0.5)),
+                       "p95": ms(percentile(latencies, 0.95)), "p99": ms(percentile(latencies, 0.99)),
+                       "max": ms(latencies[-1])},
+        "status": dict(statuses),
+    }
+
+
+# event_loop_lag_seconds histogram from the app's /metrics: {"le": cumulative count, "sum": .., "count": ..}
+async def scrape_loop_lag(client: httpx.AsyncClient) -> dict:
+    lag = {"buckets": {}, "sum": 0.0, "count": 0}
+    try:
+        r = await client.get('/metrics')
+    except httpx.HTTPError:
+        return lag
+    for line in r.text.splitlines():
+        if line.startswith('event_loop_lag_seconds_bucket'):
+            le = line.split('le="')[1].split('"')[0]
+            lag["buckets"][le] = float(line.rsplit(' ', 1)[1])
+        elif line.startswith('event_loop_lag_seconds_sum'):
+            lag["sum"] = float(line.rsplit(' ', 1)[1])
+        elif line.startswith('event_loop_lag_seconds_count'):
+            lag["count"] = float(line.rsplit(' ', 1)[1])
+    return lag
+
+
+def loop_lag_delta(before: dict, after: dict) -> dict:
+    count = after["count"] - before["count"]
+    if not count:
+        return {"samples": 0}
+    p99 = None
+    for le, total in after["buckets"].items():
+        if total - before["buckets"].get(le, 0) >= count * 0.99:
+            p99 = le  # upper bound of the bucket holding the 99th percentile
+            break
+    return {"samples": int(count), "mean_ms": round((after["sum"] - before["sum"]) / count * 1000, 3),
+            "p99_le_sec": p99}
+
+
+def read_status(pid: int, field: str) -> int | None:
+    """VmHWM / VmRSS of a process in kB, linux only"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+# reset VmHWM so each scenario gets its own peak
+def reset_peak_rss(pid: int):
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def spawn(cmd: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env})
+
+
+def stop(process: subprocess.Popen):
+    if process and process.poll() is None:
+        process.send_signal(signal.SIGINT)  # lets the app run its shutdown hook
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout} s")
+
+
+# the app won't start without its database, say so before spawning it
+async def check_db():
+    from app.dao import AsyncBaseDAO  # reads the db settings from env
+    try:
+        conn = await asyncpg.connect(AsyncBaseDAO.db_url, timeout=5)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        raise SystemExit(f"postgres is not reachable ({type(e).__name__}: {e}). The app needs it to start, "
+                         f"see the bench/load.py docstring, or pass --app-url of a running app")
+    await conn.close()
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+async def run(args) -> dict:
+    processes = []
+    app_url, app_pid = args.app_url, args.app_pid
+    try:
+        if not app_url:
+            await check_db()
+            fake_url = f'http://127.0.0.1:{args.fake_port}'
+            fake = spawn([sys.executable, '-m', 'bench.fake_llm', '--port', str(args.fake_port),
+                          '--latency-ms', str(args.latency_ms), '--error-rate', str(args.error_rate),
+                          '--rate-429', str(args.rate_429), '--seed', str(args.seed)], {})
+            processes.append(fake)
+            await wait_ready(f'{fake_url}/stats', fake)
+            app_env = {
+                "gemini_base_url": f'{fake_url}/v1beta',
+                "groq_base_url": f'{fake_url}/openai/v1',
+                "prompt_dir": os.path.join(ROOT, 'bench'),  # bench/prompt.txt
+                "rate_limit_backend": "memory",        # measure the app, not the limiter (one worker)
+                "rate_limit_capacity": "1000000000",
+                "rate_limit_refill": "1000000000",
+                "llm_http2": "false",                  # the fake server speaks http/1.1
+            }
+            app = spawn([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.app_port),
+                         '--log-level', 'warning'], app_env)
+            processes.append(app)
+            app_url, app_pid = f'http://127.0.0.1:{args.app_port}', app.pid
+            await wait_ready(f'{app_url}/metrics', app)
+
+        results = {}
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=args.timeout) as client:
+            for spec in args.scenario or DEFAULT_SCENARIOS:
+                name, requests, concurrency = spec.split(':')
+                if app_pid:
+                    reset_peak_rss(app_pid)
+                lag_before = await scrape_loop_lag(client)
+                result = await run_scenario(client, name, int(requests), int(concurrency), args)
+                result["loop_lag"] = loop_lag_delta(lag_before, await scrape_loop_lag(client))
+                if app_pid:
+                    result["peak_rss_mb"] = round((read_status(app_pid, 'VmHWM') or 0) / 1024, 1)
+                results[spec] = result
+                print(f"{spec:20} {result['rps']:8.1f} rps   p50 {result['latency_ms']['p50']:8.1f} ms   "
+                      f"p95 {result['latency_ms']['p95']:8.1f} ms   p99 {result['latency_ms']['p99']:8.1f} ms   "
+                      f"lag {result['loop_lag'].get('mean_ms', '-')} ms   rss {result.get('peak_rss_mb', '-')} MB   "
+                      f"{result['status']}")
+        return results
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test the app against a fake llm provider")
+    parser.add_argument('--scenario', action='append', help="name:requests:concurrency, repeatable")
+    parser.add_argument('--app-url', help="use a running app instead of starting one")
+    parser.add_argument('--app-pid', type=int, help="pid of that app, for memory stats")
+    parser.add_argument('--app-port', type=int, default=8100)
+    parser.add_argument('--fake-port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=800, help="fake provider median latency")
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--rate-429', type=float, default=0.05)
+    parser.add_argument('--users', type=int, default=1000, help="bench users seeded by bench.fixture")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="json file, default bench/results/<time>.json")
+    args = parser.parse_args()
+
+    started = datetime.now(timezone.utc)
+    results = asyncio.run(run(args))
+    report = {
+        "started": started.isoformat(timespec='seconds'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "results": results,
+    }
+    out = args.out or os.path.join(ROOT, 'bench', 'results', started.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Per-request overhead of the request logging middleware and log handler.
+
+Calls the ASGI app directly, no network, so the numbers are middleware + logging only.
+Compares the old BaseHTTPMiddleware and synchronous file writes with the plain ASGI
+middleware and the queue handler used now. The queue mostly shows in the tail (p99, max)
+when the log directory is on a slow disk, pass it as the second argument.
+
+    python -m bench.middleware_overhead [requests] [log dir]
+"""
+import asyncio
+import logging
+import queue
+import sys
+import tempfile
+import time
+from logging.handlers import QueueListener
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from logger import LogQueueHandler, MonthlyRotatingFileHandler, logger
+from middleware.logging import LoggingMiddleware
+
+
+# the middleware as it was before
+class BaseHTTPLoggingMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        client_ip = request.client.host if request.client else None
+        response = await call_next(request)
+        t = (time.time() - start_time) * 1000
+        logger.debug(f"{request.method} {request.url.path}\tfrom: {client_ip}\t"
+                     f"Status: {response.status_code}\tTook: {t:.2f}ms")
+        return response
+
+
+async def homepage(request):
+    return PlainTextResponse("ok")
+
+
+def make_app(middleware_class=None) -> Starlette:
+    return Starlette(routes=[Route("/", homepage)],
+                     middleware=[Middleware(middleware_class)] if middleware_class else [])
+
+
+async def run(app, n: int) -> dict[str, float]:
+    """Microseconds per request: mean, p50, p99, max."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+             "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1234), "server": ("bench", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(min(n // 10, 1000)):  # warm up
+        await app(dict(scope), receive, send)
+    took = []
+    for _ in range(n):
+        start_time = time.perf_counter()
+        await app(dict(scope), receive, send)
+        took.append((time.perf_counter() - start_time) * 1e6)
+    took.sort()
+    return {"mean": sum(took) / n, "p50": took[n // 2], "p99": took[int(n * 0.99)], "max": took[-1]}
+
+
+def show(name: str, result: dict[str, float], baseline: dict[str, float]):
+    print(f"{name:38} " + "  ".join(f"{k} {v:7.1f}" for k, v in result.items()) +
+          f"   (+{result['mean'] - baseline['mean']:.1f} us mean)")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    directory = sys.argv[2] if len(sys.argv) > 2 else tempfile.mkdtemp()
+    file_handler = MonthlyRotatingFileHandler(directory=directory)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s\t%(levelname)s:\t%(message)s"))
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler)
+    handlers = {"sync file": file_handler, "queue": LogQueueHandler(log_queue)}
+
+    saved = logger.handlers[:]
+    listener.start()
+    try:
+        print(f"{n} requests, us per request")
+        baseline = asyncio.run(run(make_app(), n))
+        show("no middleware", baseline, baseline)
+        for middleware_class in (BaseHTTPLoggingMiddleware, LoggingMiddleware):
+            for handler_name, handler in handlers.items():
+                logger.handlers = [handler]
+                show(f"{middleware_class.__name__} + {handler_name}",
+                     asyncio.run(run(make_app(middleware_class), n)), baseline)
+    finally:
+        logger.handlers = saved
+        listener.stop()
+        file_handler.close()
+
+
+if __name__ == '__main__':
+    main()
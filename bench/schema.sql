@@ -0,0 +1,12 @@
+-- app_users as the app expects it; constraint names match UserDAO.conflict_messages
+CREATE TABLE IF NOT EXISTS app_users (
+    user_id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    birth_year INTEGER,
+    email TEXT,
+    fullname TEXT,
+    created TIMESTAMP NOT NULL DEFAULT now(),
+    CONSTRAINT app_users_username_key UNIQUE (username),
+    CONSTRAINT app_users_email_key UNIQUE (email)
+);
@@ -6,11 +6,25 @@ from environs import Env
 class Config:
     site: str
     max_drawing_size_kb: int
+    drawing_max_dim: int     # до какого размера ужимать рисунок перед отправкой в LLM, px
+    drawing_bw: bool         # отправлять рисунок черно-белым (1 бит)
+    prescreen_min_ink: float     # мин. доля закрашенных пикселей, иначе холст считается пустым
+    prescreen_min_bbox: float    # мин. доля холста, занятая рисунком
+    prescreen_min_strokes: int   # мин. число отдельных штрихов
     crypt_key: str           # ключ шифрования
+    log_json: bool           # писать лог в формате json, по строке на запись
+    page_cache: bool         # рендерить страницы один раз (выключить при правке шаблонов)
+    metrics_loop_lag_interval: float  # как часто мерить задержку event loop, сек (0 - выкл)
+    bcrypt_rounds: int       # стоимость bcrypt, при смене хэши обновятся при входе
+    hash_workers: int        # потоков для хэширования паролей
+    hash_max_queue: int      # макс. очередь на хэширование, дальше 503
+    admin_users: str         # пользователи с доступом к отладочным эндпоинтам, через запятую
 
     # LLM API
     GROQ_API_KEY: str
     GEMINI_API_KEY: str
+    groq_base_url: str       # адрес API, можно подменить (напр. на bench/fake_llm.py)
+    gemini_base_url: str
 
     # DB
     host: str                # хост
@@ -18,6 +32,68 @@ class Config:
     user: str                # пользователь
     password: str            # пароль
     port: int                # порт
+    db_replica_host: str     # хост реплики для чтения ('' - читать с основной)
+    db_replica_port: int     # порт реплики
+    db_pool_min: int         # мин. соединений в пуле
+    db_pool_max: int         # макс. соединений в пуле
+    db_statement_cache_size: int     # сколько подготовленных запросов держать на соединение
+    db_max_queries: int              # после стольких запросов соединение пересоздается
+    db_max_inactive_lifetime: float  # закрывать простаивающее соединение через, сек
+    db_acquire_timeout: float        # макс. ожидание свободного соединения, сек
+
+    # LLM http client
+    llm_timeout: float              # общий таймаут запроса, сек
+    llm_connect_timeout: float      # таймаут установки соединения, сек
+    llm_max_connections: int        # макс. соединений в пуле
+    llm_max_keepalive: int          # макс. простаивающих keep-alive соединений
+    llm_keepalive_expiry: float     # сколько держать простаивающее соединение, сек
+    llm_http2: bool                 # использовать HTTP/2
+
+    # LLM retries
+    llm_deadline_sec: float         # макс. время на оценку одного рисунка, сек
+    llm_max_attempts: int           # макс. число попыток на рисунок
+    llm_backoff_base: float         # базовая пауза между попытками, сек
+    llm_backoff_max: float          # макс. пауза между попытками, сек
+
+    # LLM model scheduling
+    gemini_model_rpm: int           # лимит запросов в минуту на одну модель
+    llm_breaker_errors: int         # ошибок подряд до отключения модели
+    llm_breaker_cooldown_sec: float # на сколько отключать модель, сек
+
+    # verdict cache
+    verdict_cache_size: int         # сколько вердиктов держать в памяти
+    verdict_cache_ttl_sec: int      # время жизни вердикта, сек
+    verdict_cache_db: bool          # хранить вердикты также в БД
+    verdict_cache_phash: bool       # ключ по перцептивному хэшу вместо точного
+
+    # authenticated user cache
+    user_cache_size: int            # сколько пользователей держать в памяти
+    user_cache_ttl_sec: int         # время жизни записи, сек
+
+    # LLM debug capture
+    llm_capture_rate: float         # доля запросов к LLM, которые сохраняются (0 - выкл)
+    llm_capture_size: int           # сколько последних обменов держать в памяти
+    llm_capture_dir: str            # куда писать обмены на диск ('' - не писать)
+
+    # async job mode
+    llm_concurrency: int            # сколько рисунков оцениваются одновременно
+    job_queue_size: int             # макс. длина очереди, дальше 503
+    job_ttl_sec: int                # сколько хранить готовый результат, сек
+
+    # LLM micro-batching
+    llm_batch_window_ms: int        # сколько собирать рисунки в один запрос, мс (0 - выкл)
+    llm_batch_max: int              # макс. рисунков в одном запросе
+
+    # prompts
+    prompt_versions: str            # версии промпта с весами для A/B, напр. "default:0.8,short:0.2"
+    prompt_dir: str                 # где лежат prompt.txt и prompt.<версия>.txt
+
+    # rate limit
+    rate_limit_backend: str         # где хранить лимиты: postgres (кластер), sqlite (один хост), memory (только 1 воркер)
+    rate_limit_sqlite_path: str     # файл для sqlite, лучше на tmpfs
+    rate_limit_capacity: float      # размер корзины токенов (макс. всплеск)
+    rate_limit_refill: float        # пополнение корзины, токенов в сек
+    rate_limit_costs: str           # цена запроса по префиксу пути (и методу), напр. "/static:0,POST /api/submit-drawing:10"
 
 
 # загрузить конфиг из переменных окружения
@@ -26,14 +102,70 @@ env.read_env()
 config = Config(
     site=env('site'),
     max_drawing_size_kb=int(env('max_drawing_size_kb')),
+    drawing_max_dim=env.int('drawing_max_dim', 512),
+    drawing_bw=env.bool('drawing_bw', True),
+    prescreen_min_ink=env.float('prescreen_min_ink', 0.0005),
+    prescreen_min_bbox=env.float('prescreen_min_bbox', 0.005),
+    prescreen_min_strokes=env.int('prescreen_min_strokes', 1),
     crypt_key=env('crypt_key'),
+    log_json=env.bool('log_json', False),
+    page_cache=env.bool('page_cache', True),
+    metrics_loop_lag_interval=env.float('metrics_loop_lag_interval', 0.5),
+    bcrypt_rounds=env.int('bcrypt_rounds', 12),
+    hash_workers=env.int('hash_workers', 2),
+    hash_max_queue=env.int('hash_max_queue', 64),
+    admin_users=env('admin_users', ''),
     GROQ_API_KEY=env('GROQ_API_KEY'),
     GEMINI_API_KEY=env('GEMINI_API_KEY'),
+    groq_base_url=env('groq_base_url', 'https://api.groq.com/openai/v1'),
+    gemini_base_url=env('gemini_base_url', 'https://generativelanguage.googleapis.com/v1beta'),
     host=env('host'),
     dbname=env('dbname'),
     user=env('user'),
     password=env('password'),
     port=env.int('port'),
-
+    db_replica_host=env('db_replica_host', ''),
+    db_replica_port=env.int('db_replica_port', 5432),
+    db_pool_min=env.int('db_pool_min', 2),
+    db_pool_max=env.int('db_pool_max', 10),
+    db_statement_cache_size=env.int('db_statement_cache_size', 100),
+    db_max_queries=env.int('db_max_queries', 50000),
+    db_max_inactive_lifetime=env.float('db_max_inactive_lifetime', 300),
+    db_acquire_timeout=env.float('db_acquire_timeout', 5),
+    llm_timeout=env.float('llm_timeout', 60),
+    llm_connect_timeout=env.float('llm_connect_timeout', 5),
+    llm_max_connections=env.int('llm_max_connections', 50),
+    llm_max_keepalive=env.int('llm_max_keepalive', 20),
+    llm_keepalive_expiry=env.float('llm_keepalive_expiry', 60),
+    llm_http2=env.bool('llm_http2', True),
+    llm_deadline_sec=env.float('llm_deadline_sec', 45),
+    llm_max_attempts=env.int('llm_max_attempts', 4),
+    llm_backoff_base=env.float('llm_backoff_base', 0.5),
+    llm_backoff_max=env.float('llm_backoff_max', 4),
+    gemini_model_rpm=env.int('gemini_model_rpm', 15),
+    llm_breaker_errors=env.int('llm_breaker_errors', 3),
+    llm_breaker_cooldown_sec=env.float('llm_breaker_cooldown_sec', 30),
+    verdict_cache_size=env.int('verdict_cache_size', 2048),
+    verdict_cache_ttl_sec=env.int('verdict_cache_ttl_sec', 24 * 3600),
+    verdict_cache_db=env.bool('verdict_cache_db', False),
+    verdict_cache_phash=env.bool('verdict_cache_phash', False),
+    user_cache_size=env.int('user_cache_size', 10000),
+    user_cache_ttl_sec=env.int('user_cache_ttl_sec', 60),
+    llm_capture_rate=env.float('llm_capture_rate', 0),
+    llm_capture_size=env.int('llm_capture_size', 50),
+    llm_capture_dir=env('llm_capture_dir', ''),
+    llm_concurrency=env.int('llm_concurrency', 8),
+    job_queue_size=env.int('job_queue_size', 200),
+    job_ttl_sec=env.int('job_ttl_sec', 300),
+    llm_batch_window_ms=env.int('llm_batch_window_ms', 0),
+    llm_batch_max=env.int('llm_batch_max', 8),
+    prompt_versions=env('prompt_versions', 'default:1'),
+    prompt_dir=env('prompt_dir', '.'),
+    rate_limit_backend=env('rate_limit_backend', 'postgres'),
+    rate_limit_sqlite_path=env('rate_limit_sqlite_path', '/dev/shm/ai-app-ratelimit.db'),
+    rate_limit_capacity=env.float('rate_limit_capacity', 60),
+    rate_limit_refill=env.float('rate_limit_refill', 1),
+    rate_limit_costs=env('rate_limit_costs', '/static:0,/favicon.ico:0,GET /:0,GET /api:1,POST /api/submit-drawing:10,'
+                                             'POST /api/jobs:10,POST /token:5,POST /api/register:5'),
 )
 
@@ -1,7 +1,13 @@
+import atexit
 import logging
 import os
+import queue
 from datetime import datetime
-from logging.handlers import BaseRotatingHandler
+from logging.handlers import BaseRotatingHandler, QueueHandler, QueueListener
+
+import orjson
+
+from config import config
 
 
 # logs are saved to a file which is new every month
@@ -10,33 +16,58 @@ class MonthlyRotatingFileHandler(BaseRotatingHandler):
         self.directory = directory
         self.suffix = suffix
         self.current_month = datetime.now().strftime(self.suffix)
+        self.rollover_at = self._next_month()
         log_path = os.path.join(self.directory, self.current_month)
         super().__init__(log_path, mode='a', encoding='utf-8', delay=False)
 
+    # local time of the first second of next month, checked against record.created
+    @staticmethod
+    def _next_month() -> float:
+        now = datetime.now()
+        year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+        return datetime(year, month, 1).timestamp()
+
+    # BaseRotatingHandler.emit calls this before every write
     def shouldRollover(self, record) -> bool:
-        new_month = datetime.now().strftime(self.suffix)
-        return new_month != self.current_month
+        return record.created >= self.rollover_at
 
     def doRollover(self):
         self.stream.close()
         self.current_month = datetime.now().strftime(self.suffix)
+        self.rollover_at = self._next_month()
         new_log_path = os.path.join(self.directory, self.current_month)
         self.baseFilename = os.path.abspath(new_log_path)
         self.stream = self._open()
 
-    def emit(self, record):
-        if self.shouldRollover(record):
-            self.doRollover()
-        super().emit(record)
+
+# one json object per line, for log collectors
+class JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        entry = {"time": self.formatTime(record), "level": record.levelname, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
+
+# records go to the file on the listener thread, formatting included
+class LogQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
 
 
 LOG_DIR = "logs"
 os.makedirs(LOG_DIR, exist_ok=True)
 
 log_handler = MonthlyRotatingFileHandler(directory=LOG_DIR)
-formatter = logging.Formatter("%(asctime)s\t%(levelname)s:\t%(message)s")
+formatter = JsonFormatter() if config.log_json else logging.Formatter("%(asctime)s\t%(levelname)s:\t%(message)s")
 log_handler.setFormatter(formatter)
 
+# the event loop only puts records on a queue, file i/o happens on a background thread
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)  # flushes what is left in the queue
+
 logger = logging.getLogger("AI-APP")
 logger.setLevel(logging.DEBUG)
-logger.addHandler(log_handler)
+logger.addHandler(LogQueueHandler(log_queue))
@@ -1,38 +1,59 @@
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from slowapi.errors import RateLimitExceeded
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.middleware import SlowAPIMiddleware
+from fastapi.responses import PlainTextResponse
 
 from routers import frontend, backend, security
 from app.dao import AsyncBaseDAO
+from app.client import LLMClient
+from app.capture import capture
+from app.prompts import prompts
+from app.passwords import hasher
+from app.ratelimit import limiter
+from app.metrics import registry, loop_lag
+from app.assets import AssetFiles
 from logger import logger
 from middleware.logging import LoggingMiddleware
+from middleware.ratelimit import RateLimitMiddleware
+from middleware.metrics import MetricsMiddleware
 
 app = FastAPI()
 
-# request rate global limiter
-limiter = Limiter(key_func=get_remote_address, default_limits=["10/minute"])
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-app.add_middleware(SlowAPIMiddleware)
+# cost-weighted request rate limiter, see app/ratelimit.py
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(LoggingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # include routers
 app.include_router(frontend.router)
 app.include_router(backend.router)
 app.include_router(security.router)
-app.mount('/static', StaticFiles(directory='static'), name='static')
+app.mount('/static', AssetFiles(directory='static'), name='static')  # build assets with `python -m app.assets`
 
-# init db pools
+
+# prometheus scrape endpoint
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4')
+
+# init db pools, llm http client and prompts
 @app.on_event("startup")
 async def startup():
+    prompts.load()
     await AsyncBaseDAO.initialize_pools()
+    await LLMClient.start()
+    await backend.jobs.start()
+    await loop_lag.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    await loop_lag.stop()
+    await backend.jobs.stop()
     await AsyncBaseDAO.close_pools()
+    await LLMClient.close()
+    capture.close()
+    hasher.close()
+    logger.info(f"LLM client stats: {LLMClient.stats}")
+    logger.info(f"prompt stats: {prompts.stats}")
+    logger.info(f"rate limit stats: {limiter.stats}")
 
 
 logger.info("APP started")
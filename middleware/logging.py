@@ -1,29 +1,36 @@
 import time
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-
 from logger import logger
 
 
-# log each http request
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
+# log each http request; plain ASGI, no per-request task or body stream wrapping
+class LoggingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
         # skip logging for certain paths
-        if "/static/" in request.url.path:
-            return await call_next(request)
+        if scope["type"] != "http" or "/static/" in scope["path"]:
+            return await self.app(scope, receive, send)
+
+        start_time = time.perf_counter()
+        client_ip = scope["client"][0] if scope.get("client") else None
+        method = scope["method"]
+        path = scope["path"]
+        status_code = None
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
-        start_time = time.time()
-        client_ip = request.client.host if request.client else None
-        method = request.method
-        path = request.url.path
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_with_status)
         except Exception as e:
             logger.error(f"{method} {path}\tfrom: {client_ip}\terror: {type(e).__name__}('{str(e)}')", exc_info=False)
             raise
 
         # log str
-        t = (time.time() - start_time) * 1000
-        logger.debug(f"{method} {path}\tfrom: {client_ip}\tStatus: {response.status_code}\tTook: {t:.2f}ms")
-        return response
+        t = (time.perf_counter() - start_time) * 1000
+        logger.debug(f"{method} {path}\tfrom: {client_ip}\tStatus: {status_code}\tTook: {t:.2f}ms")
@@ -0,0 +1,34 @@
+import time
+
+from app.metrics import http_requests
+
+
+# request latency by route template, so /api/jobs/{job_id} is one series; plain ASGI
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            if route:
+                name = route.path
+            elif scope.get("endpoint"):
+                name = scope.get("root_path") or '/'  # mounted app, e.g. /static
+            else:
+                name = 'unmatched'
+            http_requests.labels(name, scope["method"], status_code).observe(time.perf_counter() - start_time)
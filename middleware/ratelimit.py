@@ -0,0 +1,37 @@
+import math
+
+from starlette.responses import JSONResponse
+
+from app.ratelimit import limiter
+from routers.security import username_from_token
+
+
+# authenticated users share one bucket across IPs, anonymous clients get one per IP
+def client_key(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode('latin-1').partition(' ')
+            if scheme.lower() == 'bearer' and token:
+                username = username_from_token(token)
+                if username:
+                    return f'user:{username}'
+            break
+    return f'ip:{scope["client"][0] if scope.get("client") else None}'
+
+
+# token bucket limit per client, weighted by the cost of the route; plain ASGI
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        cost = limiter.cost(scope["path"], scope["method"]) if scope["type"] == "http" else 0
+        if not cost:
+            return await self.app(scope, receive, send)
+
+        allowed, retry_after = await limiter.take(client_key(scope), cost)
+        if not allowed:
+            response = JSONResponse({"error": "Rate limit exceeded"}, status_code=429,
+                                    headers={"Retry-After": str(math.ceil(retry_after))})
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -1,65 +1,351 @@
+import asyncio
+import base64
+import binascii
 import datetime
 import json
+import time
 from pprint import pprint
 
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.exceptions import HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from PIL import Image
 
-from app import ai, dao
-from routers.security import get_password_hash
+from app import ai, dao, images
+from app.retry import LLMRetry, LLMVerdict
+from app.cache import verdict_cache
+from app.singleflight import SingleFlight
+from app.capture import capture
+from app.jobs import JobQueue
+from app.batcher import MicroBatcher
+from app.prompts import prompts
+from app.metrics import llm_unparsed, record_verdict
+from routers.security import get_admin_user, get_password_hash
+from app.passwords import HasherBusy
 from logger import logger
 from config import config
 
 router = APIRouter(prefix='/api', tags=['backend'])
-llm = ai.GeminiLLM()
+llm = LLMRetry(providers=[ai.GeminiLLM(), ai.LlamaVisionLLM()])
+inflight = SingleFlight()  # identical drawings submitted at once share one llm call
+# opt-in: drawings arriving within a short window are graded in one provider call
+batcher = MicroBatcher(llm=llm.providers[0], fallback=llm, window=config.llm_batch_window_ms / 1000,
+                       max_size=config.llm_batch_max) if config.llm_batch_window_ms else None
+
+
+# rasterizing costs grow with brush width and point count, so both are bounded (422 past the limits)
+MAX_BRUSH = 200             # canvas px
+MAX_STROKES = 1000
+MAX_STROKE_POINTS = 5000
+
+
+class Stroke(BaseModel):
+    w: int = Field(4, ge=1, le=MAX_BRUSH)                       # brush width, canvas px
+    e: bool = False                                             # eraser
+    p: list[int] = Field(max_length=2 * MAX_STROKE_POINTS)      # x0, y0, dx1, dy1, dx2, dy2, ...
 
 
 class SubmitDrawing(BaseModel):
-    image: str
+    image: str | None = None              # base64 png
+    strokes: list[Stroke] | None = Field(None, max_length=MAX_STROKES)  # or the strokes themselves
+    width: int = 0                        # canvas size for strokes
+    height: int = 0
     item_name: str
     language: str = 'en'
 
 
-@router.post("/submit-drawing")
-async def submit_drawing(data: SubmitDrawing):
+def too_large(size: float, language: str) -> JSONResponse:
     result = {"message": '', "passed": False}
-    size = round(len(data.image) * 3 // 4 / 1024, 2)  # kilobytes
-    logger.info(f"/submit-drawing item_name = {data.item_name}, size = {size} kb")
+    result['error'] = 'Content Too Large!' if language == 'en' else 'Слишком тяжелый файл!'
+    result['error'] += f' ({size} kb, limit = {config.max_drawing_size_kb} kb)'
+    return JSONResponse(result, status_code=413)
 
-    # check size
-    if size > config.max_drawing_size_kb:
-        result['error'] = 'Content Too Large!' if data.language == 'en' else 'Слишком тяжелый файл!'
-        result['error'] += f' ({size} kb, limit = {config.max_drawing_size_kb} kb)'
-        status_code = 413
-        return JSONResponse(result, status_code=status_code)
 
-    # prepare request to llm-provider
-    prompt = open('prompt.txt', 'r', encoding='utf-8').read().format(item_name=data.item_name, language=data.language)
-    user_msg = ai.user_message(prompt=prompt, encoded_image=data.image)
+def invalid_image(language: str) -> JSONResponse:
+    result = {"message": '', "passed": False}
+    result['error'] = 'Invalid image' if language == 'en' else 'Некорректное изображение'
+    return JSONResponse(result, status_code=422)
+
+
+def sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+
+
+# blank canvas or an already graded drawing: answer without the llm
+async def quick_answer(drawing: images.Drawing, cache_key: str, language: str) -> dict | None:
+    images.record_prescreen(drawing.screen)
+    # nothing drawn: no need to ask the llm
+    if drawing.screen.blank:
+        logger.info(f"/submit-drawing blank canvas {drawing.screen}")
+        message = '❌ The canvas is empty, draw something first!' if language == 'en' \
+            else '❌ Холст пустой, сначала нарисуйте что-нибудь!'
+        return {"message": message, "passed": False}
+
+    # same drawing for the same task was already graded
+    cached = await verdict_cache.get(cache_key)
+    if cached:
+        logger.info(f"/submit-drawing cached {cached = }")
+        return {"message": cached['message'], "passed": cached['passed']}
+    return None
+
+
+# prepare request to llm-provider
+def llm_message(drawing: images.Drawing, item_name: str, language: str, cache_key: str) -> tuple[str, str, dict]:
+    version, prompt = prompts.get(item_name, language, key=cache_key)
+    return version, prompt, ai.user_message(prompt=prompt, image=drawing.data, mime_type=drawing.mime_type)
+
+
+def timeout_error(language: str) -> str:
+    return 'AI is not responding, try again later' if language == 'en' else 'Нейросеть не отвечает, попробуйте позже'
+
+
+# blank check, cache, then the llm: shared by all submission formats
+async def evaluate(drawing: images.Drawing, item_name: str, language: str) -> tuple[dict, int]:
+    cache_key = verdict_cache.key(drawing.data, item_name, language)
+    quick = await quick_answer(drawing, cache_key, language)
+    if quick:
+        return quick, 200
+
+    result = {"message": '', "passed": False}
+    version, prompt, user_msg = llm_message(drawing, item_name, language, cache_key)
+
+    async def grade():
+        verdict = await (batcher or llm).ask(conversation=[user_msg])
+        record_verdict(None if verdict.timed_out else verdict.passed)
+        if not verdict.timed_out:
+            prompts.record(version, prompt, verdict.passed)
+            await verdict_cache.set(cache_key, verdict.message, verdict.passed)
+        return verdict
 
     try:
-        while True:
-            llm_response: str = await llm.parse_answer(conversation=[user_msg])
-            passed = ai.has_user_passed_task(llm_response=llm_response)
-            if passed is None:
-                print(f'fail {llm_response = }')
-                continue
-            break
-
-        result['message'] = llm_response
-        result['passed'] = passed
-        status_code = 200
+        verdict = await inflight.do(cache_key, grade)
+        if verdict.timed_out:
+            result['error'] = timeout_error(language)
+            status_code = 504
+        else:
+            result['message'] = verdict.message
+            result['passed'] = verdict.passed
+            status_code = 200
+        logger.info(f"/submit-drawing attempts = {verdict.attempts}, provider = {verdict.provider}")
 
     except Exception as e:
         result['error'] = str(e)
         status_code = 500
 
     logger.info(f"/submit-drawing {result = }")
+    return result, status_code
+
+
+# decode any json submission format into a normalized drawing
+async def read_submission(data: SubmitDrawing) -> images.Drawing | JSONResponse:
+    if data.strokes is not None:
+        size = round(sum(len(s.p) for s in data.strokes) * 4 / 1024, 2)  # approx. kilobytes of json
+    else:
+        size = round(len(data.image or '') * 3 // 4 / 1024, 2)  # kilobytes
+    logger.info(f"/submit-drawing item_name = {data.item_name}, size = {size} kb")
+
+    # check size
+    if size > config.max_drawing_size_kb:
+        return too_large(size, data.language)
+
+    # crop, downscale and re-encode before sending anywhere
+    try:
+        if data.strokes is not None:
+            if not 0 < data.width <= images.MAX_SIDE or not 0 < data.height <= images.MAX_SIDE:
+                raise ValueError('bad canvas size')
+            strokes = [(s.w, s.e, s.p) for s in data.strokes]
+            return await asyncio.to_thread(images.normalize_strokes, strokes, data.width, data.height)
+        image = base64.b64decode(data.image or '', validate=True)
+        return await asyncio.to_thread(images.normalize, image)
+    except (binascii.Error, OSError, ValueError, Image.DecompressionBombError):
+        return invalid_image(data.language)
+
+
+@router.post("/submit-drawing")
+async def submit_drawing(data: SubmitDrawing):
+    drawing = await read_submission(data)
+    if isinstance(drawing, JSONResponse):
+        return drawing
+    result, status_code = await evaluate(drawing, data.item_name, data.language)
+    return JSONResponse(result, status_code=status_code)
+
+
+# one streamed evaluation: verdict and text pieces go to `pieces` as they come, the verdict is returned so
+# identical submissions waiting in `inflight` get it too
+async def stream_grade(user_msg: dict, version: str, prompt: str, cache_key: str,
+                       pieces: asyncio.Queue) -> LLMVerdict:
+    provider = llm.providers[0]
+    verdict = LLMVerdict(message='', passed=None, attempts=1, provider=type(provider).__name__)
+    complete = False
+    deadline = time.monotonic() + config.llm_deadline_sec
+    stream = provider.stream_answer([user_msg])
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(stream), timeout=deadline - time.monotonic())
+            except StopAsyncIteration:
+                complete = True
+                break
+            verdict.message += chunk
+            if verdict.passed is None:
+                if not verdict.message.strip():
+                    continue
+                verdict.passed = ai.has_user_passed_task(llm_response=verdict.message.lstrip())
+                if verdict.passed is None:
+                    llm_unparsed.labels('stream').inc()
+                    break  # the answer doesn't start with a verdict
+                pieces.put_nowait(('verdict', {"passed": verdict.passed}))
+                chunk = verdict.message
+            pieces.put_nowait(('text', {"text": chunk}))
+    except Exception as e:
+        logger.warning(f"/submit-drawing/stream {type(e).__name__}('{e}')")
+    finally:
+        await stream.aclose()
+
+    # no verdict from the stream: fall back to the regular path with retries and failover,
+    # within what is left of the same deadline
+    if verdict.passed is None:
+        verdict = await llm.ask(conversation=[user_msg], deadline=deadline - time.monotonic())
+        if not verdict.timed_out:
+            complete = True
+            pieces.put_nowait(('verdict', {"passed": verdict.passed}))
+            pieces.put_nowait(('text', {"text": verdict.message}))
+
+    record_verdict(None if verdict.timed_out else verdict.passed)
+    if complete:
+        prompts.record(version, prompt, verdict.passed)
+        await verdict_cache.set(cache_key, verdict.message, verdict.passed)
+    return verdict
+
+
+# same as /submit-drawing, but as server-sent events: `verdict` as soon as the first token decides it,
+# then `text` pieces of the explanation, then `done` (or `error` with the status /submit-drawing would return)
+@router.post("/submit-drawing/stream")
+async def submit_drawing_stream(data: SubmitDrawing):
+    drawing = await read_submission(data)
+    if isinstance(drawing, JSONResponse):
+        return drawing
+    cache_key = verdict_cache.key(drawing.data, data.item_name, data.language)
+    quick = await quick_answer(drawing, cache_key, data.language)
+
+    async def events():
+        if quick:
+            yield sse('verdict', {"passed": quick['passed']})
+            yield sse('text', {"text": quick['message']})
+            yield sse('done', quick)
+            return
+
+        version, prompt, user_msg = llm_message(drawing, data.item_name, data.language, cache_key)
+
+        # an identical drawing already being graded (streamed or not) is joined and nothing is streamed
+        # here: its verdict and text come at once when it is done
+        pieces = asyncio.Queue()
+        shared = asyncio.ensure_future(
+            inflight.do(cache_key, lambda: stream_grade(user_msg, version, prompt, cache_key, pieces)))
+        piece, streamed = None, False
+        try:
+            while not shared.done() or not pieces.empty():
+                if shared.done():
+                    event, payload = pieces.get_nowait()
+                else:
+                    piece = asyncio.ensure_future(pieces.get())
+                    await asyncio.wait([piece, shared], return_when=asyncio.FIRST_COMPLETED)
+                    if not piece.done():
+                        piece.cancel()
+                        continue
+                    event, payload = piece.result()
+                streamed = True
+                yield sse(event, payload)
+            verdict = shared.result()
+        except Exception as e:
+            logger.warning(f"/submit-drawing/stream {type(e).__name__}('{e}')")
+            yield sse('error', {"error": str(e), "status": 500})
+            return
+        finally:
+            # client gone: stop waiting, inflight cancels the call if nobody else needs it
+            for future in (piece, shared):
+                if future:
+                    future.cancel()
+
+        if verdict.timed_out:
+            yield sse('error', {"error": timeout_error(data.language), "status": 504})
+            return
+        if not streamed:
+            yield sse('verdict', {"passed": verdict.passed})
+            yield sse('text', {"text": verdict.message})
+        logger.info(f"/submit-drawing/stream attempts = {verdict.attempts}, provider = {verdict.provider}, "
+                    f"passed = {verdict.passed}")
+        yield sse('done', {"message": verdict.message, "passed": verdict.passed})
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+# raw image bytes as the request body; oversized uploads are cut off while streaming
+@router.post("/submit-drawing/raw")
+async def submit_drawing_raw(request: Request, item_name: str, language: str = 'en'):
+    limit = config.max_drawing_size_kb * 1024
+    declared = request.headers.get('content-length', '')
+    if declared.isdigit() and int(declared) > limit:
+        return too_large(round(int(declared) / 1024, 2), language)
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            logger.info(f"/submit-drawing/raw aborted at {len(body)} bytes")
+            return too_large(round(len(body) / 1024, 2), language)
+    logger.info(f"/submit-drawing/raw item_name = {item_name}, size = {round(len(body) / 1024, 2)} kb")
+
+    # images.normalize rejects oversized dimensions from the header, before decoding any pixels
+    try:
+        drawing = await asyncio.to_thread(images.normalize, body)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return invalid_image(language)
+
+    result, status_code = await evaluate(drawing, item_name, language)
     return JSONResponse(result, status_code=status_code)
 
 
+# async mode: enqueue the drawing, then poll for the verdict
+jobs = JobQueue(handler=evaluate, workers=config.llm_concurrency, maxsize=config.job_queue_size,
+                ttl=config.job_ttl_sec)
+
+
+@router.post("/jobs", status_code=202)
+async def submit_job(data: SubmitDrawing):
+    drawing = await read_submission(data)
+    if isinstance(drawing, JSONResponse):
+        return drawing
+
+    job = jobs.submit(drawing, data.item_name, data.language)
+    if not job:
+        result = {"error": 'Server is busy, try again later' if data.language == 'en'
+                  else 'Сервер перегружен, попробуйте позже'}
+        return JSONResponse(result, status_code=503, headers={"Retry-After": str(jobs.retry_after())})
+    return JSONResponse({"job_id": job.id, "position": jobs.position(job)}, status_code=202)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, detail='Job not found')
+    result = {"job_id": job.id, "status": job.status, "position": jobs.position(job)}
+    if job.status == 'done':
+        result.update(result=job.result, status_code=job.status_code)
+    return JSONResponse(result)
+
+
+# last sampled llm exchanges, for debugging prompts and provider errors
+# captured prompts hold other users' drawings and answers: admins only
+@router.get("/llm-exchanges")
+async def llm_exchanges(n: int = 10, admin: dict = Depends(get_admin_user)):
+    if not capture.rate:
+        raise HTTPException(404)
+    return JSONResponse(capture.last(n))
+
+
 class UserRegForm(BaseModel):
     username: str
     password: str
@@ -67,33 +353,42 @@ class UserRegForm(BaseModel):
     email: str | None = None
     fullname: str | None = None
 
+    # explicit raises, not assert: asserts are stripped under python -O
     async def valid(self):
         year_now = datetime.datetime.now().year
-        assert self.birth_year in range(year_now - 100, year_now - 10), 'Unacceptable year'
-        assert len(self.password) > 5, 'Minimal password length is 6 symbols'
-        assert not await dao.UserDAO.username_exists(self.username), 'This username is already taken.'
+        if self.birth_year not in range(year_now - 100, year_now - 10):
+            raise HTTPException(422, detail='Unacceptable year')
+        if len(self.password) <= 5:
+            raise HTTPException(422, detail='Minimal password length is 6 symbols')
 
 
 @router.post("/register")
 async def _(form: UserRegForm):
-    result = {}
+    result, headers = {}, None
     try:
         await form.valid()
         created = datetime.datetime.now()
-        user = await dao.UserDAO.add(**{"username": form.username,
-                                        "password": get_password_hash(form.password),  # store hashed
-                                        "birth_year": form.birth_year,
-                                        "email": form.email, "fullname": form.fullname,
-                                        "created": created})
+        # one query: a taken username comes back as a conflict on the unique index
+        user, conflict = await dao.UserDAO.add_unique(**{"username": form.username,
+                                                         "password": await get_password_hash(form.password),  # store hashed
+                                                         "birth_year": form.birth_year,
+                                                         "email": form.email, "fullname": form.fullname,
+                                                         "created": created})
+        if conflict:
+            raise HTTPException(422, detail=dao.UserDAO.conflict_messages.get(conflict, 'This user already exists.'))
         status_code = 200
 
-    except AssertionError as e:
-        status_code = 422
-        result['error'] = f'Validation error: {e}'
+    except HTTPException as e:
+        status_code = e.status_code
+        result['error'] = f'Validation error: {e.detail}'
+    except HasherBusy:
+        status_code = 503
+        result['error'] = 'Server is busy, try again later'
+        headers = {"Retry-After": "1"}  # same as /token
     except Exception as e:
         status_code = 500
         result['error'] = 'Database error'
         print(f'register error:', e)
 
     logger.info(f"/register {result = }")
-    return JSONResponse(result, status_code=status_code)
+    return JSONResponse(result, status_code=status_code, headers=headers)
@@ -1,30 +1,70 @@
+import gzip
+import hashlib
+
 from fastapi import APIRouter
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import Response, FileResponse
+
+from app.assets import accepted_encoding, asset_url, etag_matches
+from config import config
 
 
 router = APIRouter(prefix='', tags=['frontend'])
 templates = Jinja2Templates(directory='templates')
+templates.env.globals['asset_url'] = asset_url
 title = "App"
 
+
+class RenderedPage:
+    """Page html rendered once, with its gzip copy and an ETag for each."""
+
+    def __init__(self, html: str):
+        self.body = html.encode()
+        self.gzip = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.blake2b(self.body, digest_size=8).hexdigest()
+        self.etag, self.gzip_etag = f'"{digest}"', f'"{digest}-gz"'
+
+
+# pages depend only on the template and the title, so they are rendered once per process
+_pages: dict[str, RenderedPage] = {}
+
+
+def page(request: Request, name: str, **context) -> Response:
+    rendered = _pages.get(name)
+    if rendered is None:
+        rendered = RenderedPage(templates.get_template(name).render(title=title, **context))
+        if config.page_cache:
+            _pages[name] = rendered
+
+    # revalidated on every visit, an unchanged page costs a 304 without a body
+    compressed = accepted_encoding(request.headers.get('accept-encoding', ''), ('gzip',))
+    etag = rendered.gzip_etag if compressed else rendered.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get('if-none-match', ''), etag):
+        return Response(status_code=304, headers=headers)
+    if compressed:
+        headers["Content-Encoding"] = 'gzip'
+        return Response(rendered.gzip, media_type='text/html', headers=headers)
+    return Response(rendered.body, media_type='text/html', headers=headers)
+
+
 # favicon
 @router.get("images/favicon.ico")
 async def _():
     return FileResponse("images/favicon.ico")
 
 # главная страница
-@router.get("/", response_class=HTMLResponse)
+@router.get("/")
 async def _(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request, "title": title})
+    return page(request, "index.html")
 
 # рисовалка
-@router.get("/draw", response_class=HTMLResponse)
+@router.get("/draw")
 async def _(request: Request):
-    return templates.TemplateResponse("draw.html", {"request": request, "title": title})
+    return page(request, "draw.html")
 
 # user registration
 @router.get("/auth")
-def _(request: Request):
-    return templates.TemplateResponse("auth.html", {"request": request})
-
+async def _(request: Request):
+    return page(request, "auth.html")
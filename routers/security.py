@@ -1,19 +1,20 @@
 from datetime import datetime, timedelta, timezone
 
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi import APIRouter, Depends, HTTPException
 
 from config import config
 from app import dao
+from app.cache import user_cache, token_cache
+from app.passwords import hasher, HasherBusy
 
 
 SECRET_KEY = config.crypt_key
 ALGORITHM = "HS256"
 EXPIRE_SEC = 300
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+ADMINS = {name.strip() for name in config.admin_users.split(',') if name.strip()}
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
 
@@ -31,16 +32,22 @@ class User(BaseModel):
     fullname: str | None = None
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return await hasher.verify_and_update(plain_password, hashed_password)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await hasher.hash(password)
 
 async def authenticate_user(username: str, password: str):
     user = await dao.UserDAO.find_one_or_none(username=username)
-    if not user or not verify_password(password, user['password']):
+    if not user:
+        return False
+    valid, new_hash = await verify_password(password, user['password'])
+    if not valid:
         return False
+    # bcrypt cost changed since this hash was made
+    if new_hash:
+        await dao.UserDAO.update(user[dao.UserDAO.pk_column], password=new_hash)
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
@@ -54,22 +61,47 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def username_from_token(token: str) -> str | None:
+    """Verified subject of the token, None if it is invalid or expired. No db lookup"""
+    # signature already checked for this token
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        username = payload.get('sub')
+        if username is None:
+            return None
+
+        # never keep a token past its expiry
+        ttl = token_cache.ttl
+        if payload.get('exp'):
+            ttl = min(ttl, payload['exp'] - datetime.now(timezone.utc).timestamp())
+        token_cache.set(token, username, ttl=ttl)
+    return username
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     creds_exception = HTTPException(401, detail="Could not validate credentials",
                                     headers={"WWW-Authenticate": "Bearer"})
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get('sub')
-        if username is None:
-            raise creds_exception
-        token_data = TokenData(username=username)
 
-    except JWTError:
+    username = username_from_token(token)
+    if username is None:
         raise creds_exception
 
-    user = await dao.UserDAO.find_one_or_none(username=token_data.username)
+    # user row, dropped from the cache by UserDAO.update / delete
+    user = user_cache.get(username)
     if user is None:
-        raise creds_exception
+        user = await dao.UserDAO.find_one_or_none(username=username)
+        if user is None:
+            raise creds_exception
+        user_cache.set(username, user)
+    return user
+
+# debug endpoints: only users listed in config.admin_users
+async def get_admin_user(user: dict = Depends(get_current_user)):
+    if user['username'] not in ADMINS:
+        raise HTTPException(403, detail="Not allowed")
     return user
 
 
@@ -77,7 +109,10 @@ router = APIRouter(tags=['security'])
 
 @router.post('/token', response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = await authenticate_user(form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(form_data.username, form_data.password)
+    except HasherBusy:
+        raise HTTPException(503, detail="Too many login attempts, try again later", headers={"Retry-After": "1"})
     if not user:
         raise HTTPException(401, detail="Incorrect username or password",
                             headers={"WWW-Authenticate": "Bearer"})
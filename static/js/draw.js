@@ -33,6 +33,13 @@ document.addEventListener('DOMContentLoaded', function() {
   let redoHistory = [];
   let currentHistoryIndex = -1;
 
+  // Strokes are sent to the server instead of a png: [x0, y0, dx1, dy1, ...]
+  const submitAsStrokes = true;
+  let strokes = [];
+  let strokeHistory = [];
+  let strokeX = 0;
+  let strokeY = 0;
+
   // Language Dictionaries
   const translations = {
     en: {
@@ -78,6 +85,9 @@ document.addEventListener('DOMContentLoaded', function() {
     ctx.lineWidth = brushSize * 2; // Scale up brush size
     ctx.strokeStyle = '#000000';
 
+    // Resizing clears the canvas
+    strokes = [];
+
     // Save initial canvas state
     saveCanvasState();
   }
@@ -86,6 +96,10 @@ document.addEventListener('DOMContentLoaded', function() {
   function startDrawing(e) {
     isDrawing = true;
     [lastX, lastY] = getPointerPosition(e);
+
+    // Start a new stroke
+    [strokeX, strokeY] = [Math.round(lastX), Math.round(lastY)];
+    strokes.push({ w: ctx.lineWidth, e: isErasing, p: [strokeX, strokeY] });
   }
 
   function draw(e) {
@@ -104,6 +118,13 @@ document.addEventListener('DOMContentLoaded', function() {
     ctx.stroke();
 
     [lastX, lastY] = [currentX, currentY];
+
+    // Append the point as a delta from the previous one
+    const [x, y] = [Math.round(currentX), Math.round(currentY)];
+    if (x !== strokeX || y !== strokeY) {
+      strokes[strokes.length - 1].p.push(x - strokeX, y - strokeY);
+      [strokeX, strokeY] = [x, y];
+    }
   }
 
   function stopDrawing() {
@@ -133,14 +154,17 @@ document.addEventListener('DOMContentLoaded', function() {
     // Clear any redo history when a new action is performed
     if (currentHistoryIndex < drawingHistory.length - 1) {
       drawingHistory = drawingHistory.slice(0, currentHistoryIndex + 1);
+      strokeHistory = strokeHistory.slice(0, currentHistoryIndex + 1);
     }
 
     drawingHistory.push(canvas.toDataURL());
+    strokeHistory.push(strokes.slice());
     currentHistoryIndex = drawingHistory.length - 1;
 
     // Limit history size to prevent memory issues
     if (drawingHistory.length > 30) {
       drawingHistory.shift();
+      strokeHistory.shift();
       currentHistoryIndex--;
     }
 
@@ -165,6 +189,7 @@ document.addEventListener('DOMContentLoaded', function() {
   }
 
   function loadCanvasState(index) {
+    strokes = strokeHistory[index].slice();
     const img = new Image();
     img.src = drawingHistory[index];
     img.onload = function() {
@@ -187,6 +212,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
   function clearCanvas() {
     ctx.clearRect(0, 0, canvas.width, canvas.height);
+    strokes = [];
     saveCanvasState();
   }
 
@@ -229,6 +255,16 @@ document.addEventListener('DOMContentLoaded', function() {
 
   // Prepare data to submit
     try {
+      let data;
+      if (submitAsStrokes) {
+        data = {
+          strokes: strokes,
+          width: canvas.width,
+          height: canvas.height,
+          item_name: currentItem,
+          language: currentLanguage
+        };
+      } else {
         // Create a temporary canvas to send png as non-transparent
         const tempCanvas = document.createElement("canvas");
         const tempCtx = tempCanvas.getContext("2d");
@@ -247,14 +283,15 @@ document.addEventListener('DOMContentLoaded', function() {
         // Convert canvas to Base64
         const dataUrl = tempCanvas.toDataURL("image/png");
         const base64Image = dataUrl.split(",")[1];  // Remove "data:image/png;base64,"
-        const data = {
+        data = {
             image: base64Image,
             item_name: currentItem,
             language: currentLanguage
-      };
+        };
+      }
 
       // Send to API
-      const response = await fetch('/api/submit-drawing', {
+      const response = await fetch('/api/submit-drawing/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
@@ -262,13 +299,15 @@ document.addEventListener('DOMContentLoaded', function() {
         body: JSON.stringify(data)
       });
 
-      const result = await response.json();
-
-      // Hide loading overlay
-      loadingOverlay.classList.add('hidden');
+      // Errors like "too large" come back as plain json
+      if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+        const result = await response.json();
+        loadingOverlay.classList.add('hidden');
+        showResultPopup(result);
+        return;
+      }
 
-      // Show result popup
-      showResultPopup(result);
+      await readResultStream(response);
 
     } catch (error) {
       console.error('Error submitting drawing:', error);
@@ -283,6 +322,48 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   }
 
+  // Render server-sent events as they arrive: the popup opens on the verdict and the text grows
+  async function readResultStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line
+      let end;
+      while ((end = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, end);
+        buffer = buffer.slice(end + 2);
+
+        let event = 'message';
+        let payload = '';
+        rawEvent.split('\n').forEach(line => {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) payload += line.slice(5).trim();
+        });
+        handleResultEvent(event, JSON.parse(payload));
+      }
+    }
+  }
+
+  function handleResultEvent(event, data) {
+    if (event === 'verdict') {
+      loadingOverlay.classList.add('hidden');
+      showResultPopup({ message: '', passed: data.passed });
+    } else if (event === 'text') {
+      popupMessage.textContent += data.text;
+    } else if (event === 'done') {
+      popupMessage.textContent = data.message;
+    } else if (event === 'error') {
+      loadingOverlay.classList.add('hidden');
+      showResultPopup(data);
+    }
+  }
+
   function showResultPopup(result) {
     const popupContent = responsePopup.querySelector('.popup-content');
 
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# config.py requires these; the tests never reach a real provider or database
+for name, value in {"site": "http://localhost", "max_drawing_size_kb": "500", "crypt_key": "test",
+                    "GROQ_API_KEY": "test", "GEMINI_API_KEY": "test", "host": "localhost", "dbname": "test",
+                    "user": "test", "password": "test", "port": "5432"}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
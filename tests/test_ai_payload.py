@@ -0,0 +1,59 @@
+import os
+import tracemalloc
+
+import orjson
+
+from app import ai
+from app.capture import ExchangeCapture
+
+IMAGE = os.urandom(150 * 1024)
+
+
+def conversation(item_name: str = 'car') -> list:
+    return [ai.user_message(f"Is this a {item_name}?", image=IMAGE)]
+
+
+def test_gemini_body_holds_the_image():
+    _, _, payload = ai.GeminiLLM()._prepare_request(conversation())
+    body = orjson.loads(ai.build_body(payload))
+    inline = body["contents"][0]["parts"][1]["inline_data"]
+    assert inline["mime_type"] == "image/png"
+    assert ai.base64.b64decode(inline["data"]) == IMAGE
+
+
+def test_groq_body_holds_a_data_url():
+    _, _, payload = ai.LlamaVisionLLM()._prepare_request(conversation())
+    body = orjson.loads(ai.build_body(payload))
+    url = body["messages"][0]["content"][1]["image_url"]["url"]
+    assert url.startswith("data:image/png;base64,")
+    assert ai.base64.b64decode(url.split(',', 1)[1]) == IMAGE
+
+
+def test_user_text_is_never_taken_for_an_image():
+    item_name = '\x00image:0\x00 "data": "x"'
+    _, _, payload = ai.GeminiLLM()._prepare_request(conversation(item_name))
+    parts = orjson.loads(ai.build_body(payload))["contents"][0]["parts"]
+    assert parts[0]["text"] == f"Is this a {item_name}?"
+    assert ai.base64.b64decode(parts[1]["inline_data"]["data"]) == IMAGE
+
+
+def test_capture_never_keeps_image_bytes():
+    capture = ExchangeCapture(rate=1, size=1)
+    _, _, payload = ai.GeminiLLM()._prepare_request(conversation())
+    capture.record('gemini', 'model', payload, {"status_code": 200}, 0.1)
+    request = capture.last(1)[0]["request"]
+    assert request["contents"][0]["parts"][1]["inline_data"]["data"] == f"<image {len(IMAGE)} bytes>"
+
+
+def test_peak_allocations_per_request():
+    _, _, payload = ai.GeminiLLM()._prepare_request(conversation())
+    tracemalloc.start()
+    try:
+        body = ai.build_body(payload)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # the base64 of the image plus the joined body, no extra copies of either
+    encoded = len(IMAGE) * 4 // 3
+    assert len(body) < encoded + 1024
+    assert peak < 2 * encoded + 64 * 1024
@@ -0,0 +1,22 @@
+from app.assets import accepted_encoding, etag_matches
+
+
+def test_accepted_encoding_prefers_available_order():
+    assert accepted_encoding('gzip, br', ('br', 'gzip')) == 'br'
+    assert accepted_encoding('gzip', ('br', 'gzip')) == 'gzip'
+    assert accepted_encoding('', ('br', 'gzip')) is None
+
+
+def test_explicit_refusal_wins_over_wildcard():
+    assert accepted_encoding('gzip;q=0, *', ('gzip',)) is None
+    assert accepted_encoding('br;q=0, *', ('br', 'gzip')) == 'gzip'
+    assert accepted_encoding('*;q=0', ('gzip',)) is None
+
+
+def test_etag_matches_whole_tags():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches('"abc-gz"', '"abc"')
+    assert not etag_matches('"xabcx"', '"abc"')
+    assert not etag_matches('', '"abc"')
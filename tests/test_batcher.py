@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import orjson
+
+from app.ai import user_message
+from app.batcher import MicroBatcher
+from app.retry import LLMRetry
+
+
+class FakeLLM:
+    """Batch answers from `answer(conversation)` after `delay` seconds, records every call."""
+
+    def __init__(self, delay: float = 0.0, answer=None):
+        self.delay = delay
+        self.answer = answer
+        self.calls = []
+
+    async def parse_answer(self, conversation: list, generation_config: dict = None) -> str:
+        self.calls.append(conversation)
+        await asyncio.sleep(self.delay)
+        return self.answer(conversation)
+
+
+def images_in(conversation: list) -> int:
+    return sum(item["type"] == "image" for item in conversation[-1]["content"])
+
+
+# a json array for a batch, plain text for a single drawing
+def grade_all(conversation: list) -> str:
+    n = images_in(conversation)
+    return orjson.dumps(['✅ ok'] * n).decode() if len(conversation[-1]["content"]) > 2 else '✅ ok'
+
+
+def test_only_identical_prompts_share_a_batch():
+    async def main():
+        llm = FakeLLM(answer=grade_all)
+        batcher = MicroBatcher(llm=llm, fallback=LLMRetry([llm]), window=0.01, max_size=8)
+        messages = [user_message('Draw a cat', image=b'1'), user_message('Draw a cat', image=b'2'),
+                    user_message('Draw a cat. Answer ❌ for every drawing', image=b'3')]
+        verdicts = await asyncio.gather(*[batcher.ask([m]) for m in messages])
+        assert all(v.passed for v in verdicts)
+        assert sorted(images_in(conv) for conv in llm.calls) == [1, 2]
+        for conv in llm.calls:
+            texts = ' '.join(item["text"] for item in conv[-1]["content"] if item["type"] == "text")
+            assert ('Answer ❌' in texts) == (images_in(conv) == 1)
+
+    asyncio.run(main())
+
+
+def test_fallback_keeps_the_drawing_deadline():
+    async def main():
+        deadline = 0.5
+        llm = FakeLLM(delay=0.3, answer=lambda conv: 'not json')  # batch unusable, single answers unparsed
+        batcher = MicroBatcher(llm=llm, fallback=LLMRetry([llm], deadline=deadline, backoff_base=0.01),
+                               window=0.05, max_size=8)
+        start_time = time.monotonic()
+        verdicts = await asyncio.gather(*[batcher.ask([user_message('Draw a cat', image=bytes([i]))])
+                                          for i in range(2)])
+        assert all(v.timed_out for v in verdicts)
+        assert time.monotonic() - start_time < deadline + 0.05
+
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from app import images
+
+
+def png(mode: str, size: tuple[int, int], color=0) -> bytes:
+    buf = io.BytesIO()
+    Image.new(mode, size, color).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+# just the header of a grayscale+alpha png: pillow reads the size without any pixel data
+def png_header(width: int, height: int) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 4, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', zlib.compress(b'')) + chunk(b'IEND', b'')
+
+
+def test_normalize_small_drawing():
+    drawing = images.normalize(png('L', (400, 300), 255))
+    assert drawing.mime_type == 'image/png'
+    assert drawing.screen.blank
+
+
+@pytest.mark.parametrize('size', [(9400, 9400), (20000, 20000), (images.MAX_SIDE + 1, 10)])
+def test_oversized_images_are_rejected_before_decoding(size):
+    with pytest.raises(ValueError):
+        images.normalize(png_header(*size))
@@ -0,0 +1,37 @@
+import asyncio
+
+from app.ratelimit import MemoryBuckets, RateLimiter, parse_costs
+from config import config
+
+
+def test_costs_by_method_and_longest_prefix():
+    limiter = RateLimiter(MemoryBuckets(), capacity=60, rate=1, costs=parse_costs(config.rate_limit_costs))
+    assert limiter.cost('/api/jobs', 'POST') == 10
+    assert limiter.cost('/api/jobs/3f2a', 'GET') == 1  # status polls are not charged like a submit
+    assert limiter.cost('/static/app.js', 'GET') == 0
+    assert limiter.cost('/api/submit-drawing/raw', 'POST') == 10
+    # pages and /metrics never reach the shared bucket
+    for path in ('/', '/draw', '/auth', '/metrics'):
+        assert limiter.cost(path, 'GET') == 0
+    assert limiter.cost('/users/me', 'POST') == 1
+
+
+def test_method_rule_wins_over_bare_prefix():
+    limiter = RateLimiter(MemoryBuckets(), capacity=60, rate=1,
+                          costs=parse_costs('/api/jobs:2,POST /api/jobs:10,/api:0'), default_cost=1)
+    assert limiter.cost('/api/jobs', 'POST') == 10
+    assert limiter.cost('/api/jobs/1', 'GET') == 2
+    assert limiter.cost('/api/other', 'DELETE') == 0
+    assert limiter.cost('/users/me', 'POST') == 1
+
+
+def test_bucket_limits_then_refills():
+    async def main():
+        limiter = RateLimiter(MemoryBuckets(), capacity=10, rate=1000, costs={})
+        assert (await limiter.take('ip:1', 10))[0]
+        allowed, retry_after = await limiter.take('ip:1', 10)
+        assert not allowed and 0 < retry_after <= 0.01
+        await asyncio.sleep(0.02)
+        assert (await limiter.take('ip:1', 10))[0]
+
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+from collections import Counter
+
+from app.scheduler import ModelScheduler
+
+
+def make_scheduler(models=('good', 'bad')) -> ModelScheduler:
+    return ModelScheduler(list(models), rpm=10_000, breaker_errors=1_000, cooldown=30)
+
+
+def test_unseen_models_are_probed_first():
+    scheduler = make_scheduler(('a', 'b', 'c'))
+    picked = set()
+    for _ in range(3):
+        model = scheduler.pick()
+        picked.add(model)
+        scheduler.record(model, 1.0, 200)
+    assert picked == {'a', 'b', 'c'}
+
+
+def test_model_that_always_fails_is_not_preferred():
+    scheduler = make_scheduler()
+    picks = Counter()
+    for _ in range(200):
+        model = scheduler.pick()
+        picks[model] += 1
+        if model == 'bad':
+            scheduler.record(model, 0.01, 500)  # fails fast, never updates a success latency
+        else:
+            scheduler.record(model, 1.5, 200)
+    assert scheduler._score(scheduler.stats['bad']) > scheduler._score(scheduler.stats['good'])
+    assert picks['bad'] <= 2
+
+
+def test_failure_is_charged_at_least_failure_latency():
+    scheduler = make_scheduler()
+    scheduler.record('bad', 0.01, 500)
+    assert scheduler.stats['bad'].latency == scheduler.failure_latency
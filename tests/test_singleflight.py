@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    async def main():
+        flight, calls = SingleFlight(), []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'verdict'
+
+        results = await asyncio.gather(*[flight.do('k', fn) for _ in range(5)])
+        assert results == ['verdict'] * 5
+        assert len(calls) == 1 and len(flight) == 0
+
+    asyncio.run(main())
+
+
+def test_exception_reaches_every_waiter():
+    async def main():
+        flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ValueError('provider down')
+
+        results = await asyncio.gather(*[flight.do('k', fn) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+
+    asyncio.run(main())
+
+
+def test_caller_after_last_waiter_cancelled_gets_a_new_call():
+    async def main():
+        flight, started = SingleFlight(), []
+
+        async def fn():
+            started.append(1)
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                await asyncio.sleep(0.01)  # slow cleanup: the task stays not done for a while
+                raise
+            return 'verdict'
+
+        first = asyncio.create_task(flight.do('k', fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # the shared task is still finishing its cancellation here
+        assert await flight.do('k', fn) == 'verdict'
+        assert len(started) == 2
+
+    asyncio.run(main())